@@ -7,16 +7,20 @@ Professional Document Conversion Tool
 import streamlit as st
 import json
 import os
-import tempfile
-import shutil
+import hashlib
 import zipfile
 from pathlib import Path
 from io import BytesIO
 from datetime import datetime
 import base64
 
-from word_processor import extract_document_structure, save_images
+from word_processor import extract_and_save
 from json_builder import build_elementor_json
+from json_writer import save_json
+from conversion_cache import ConversionCache
+import image_pipeline
+from media_store import MediaStore
+from workspaces import WorkspaceManager
 from credits import show_credits_sidebar, show_credits_footer, show_about_page
 
 
@@ -132,17 +136,84 @@ st.markdown("""
 # Session state
 if 'converted' not in st.session_state:
     st.session_state.converted = False
-if 'json_data' not in st.session_state:
-    st.session_state.json_data = None
+if 'conversion_id' not in st.session_state:
+    # Conversion cache key: identifies the results (and cached ZIP) of a conversion
+    st.session_state.conversion_id = None
+if 'job_id' not in st.session_state:
+    # Workspace of the current conversion (outputs/jobs/<job_id>)
+    st.session_state.job_id = None
+if 'jobs' not in st.session_state:
+    # Every workspace created by this session (removed by Clear Cache)
+    st.session_state.jobs = []
+if 'json_path' not in st.session_state:
+    # The JSON stays on disk: only its path is kept in the session
+    st.session_state.json_path = None
 if 'stats' not in st.session_state:
     st.session_state.stats = {}
 if 'filename' not in st.session_state:
     st.session_state.filename = ""
+if 'parsed_documents' not in st.session_state:
+    # Intermediate artifacts (structure + image metadata) per uploaded document
+    st.session_state.parsed_documents = {}
+
+# Number of parsed documents kept per session for layout changes
+MAX_PARSED_DOCUMENTS = 3
+PACKAGE_FILENAME = "package.zip"
+
+@st.cache_resource
+def get_conversion_cache():
+    """Cache disque des conversions, partagé par toutes les sessions"""
+    return ConversionCache()
+
+@st.cache_resource
+def get_media_store():
+    """Stockage d'images adressé par contenu, partagé par toutes les sessions"""
+    return MediaStore()
+
+@st.cache_resource
+def get_workspaces():
+    """Espaces de travail par conversion, balayés en arrière-plan (TTL + quota)"""
+    # Removing a workspace releases its images in the shared media store
+    workspaces = WorkspaceManager(media_store=get_media_store())
+    workspaces.start_sweeper()
+    return workspaces
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def get_json_bytes(conversion_id: str, json_path: str) -> bytes:
+    """JSON d'une conversion, lu une seule fois par conversion"""
+    with open(json_path, 'rb') as f:
+        return f.read()
+
+@st.cache_data(max_entries=8, show_spinner="Building ZIP package...")
+def get_zip_package(conversion_id: str, json_path: str, images_dir: str) -> bytes:
+    """ZIP (JSON + images) mis en cache par ID de conversion : les reruns ne le reconstruisent pas"""
+    # Paquet écrit pendant la conversion
+    package_file = Path(json_path).parent / PACKAGE_FILENAME
+    if package_file.exists():
+        return package_file.read_bytes()
+    
+    zip_buffer = BytesIO()
+    
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # JSON
+        json_file = Path(json_path)
+        if json_file.exists():
+            zf.write(json_file, json_file.name)
+        
+        # Images
+        images_path = Path(images_dir)
+        if images_path.exists():
+            for img_file in images_path.glob("*"):
+                zf.write(img_file, f"images/{img_file.name}")
+    
+    return zip_buffer.getvalue()
 
 def reset_conversion():
     """Réinitialise la conversion pour un nouveau fichier"""
     st.session_state.converted = False
-    st.session_state.json_data = None
+    st.session_state.conversion_id = None
+    st.session_state.job_id = None
+    st.session_state.json_path = None
     st.session_state.stats = {}
     st.session_state.filename = ""
 
@@ -196,6 +267,25 @@ with st.sidebar:
         value=True,
         help="Include JSON + images folder in ZIP archive"
     )
+    compact_json = st.checkbox(
+        "Compact JSON",
+        value=False,
+        help="Write JSON without indentation (smaller file)"
+    )
+    optimize_images = st.checkbox(
+        "Optimize Images",
+        value=False,
+        help=f"Resize to {image_pipeline.DEFAULT_MAX_WIDTH}px max, convert to WebP and write responsive widths"
+    )
+    if optimize_images and image_pipeline.avif_supported():
+        avif_images = st.checkbox(
+            "Also write AVIF",
+            value=False,
+            help="Additional AVIF variants (smaller, slower to encode)"
+        )
+    else:
+        avif_images = False
+    image_options = image_pipeline.default_options(avif=avif_images) if optimize_images else None
     
     st.markdown("---")
     
@@ -208,10 +298,18 @@ with st.sidebar:
         st.session_state.show_about = True
     
     # Cache management
+    # Only this session's workspaces are removed, other users keep their files
     if st.button("Clear Cache", type="secondary", use_container_width=True):
-        if Path("outputs").exists():
-            shutil.rmtree("outputs")
-            Path("outputs").mkdir()
+        workspaces = get_workspaces()
+        for job_id in st.session_state.jobs:
+            workspaces.remove(job_id)
+        # Images no longer used by any conversion
+        get_media_store().gc()
+        st.session_state.jobs = []
+        st.session_state.parsed_documents = {}
+        get_json_bytes.clear()
+        get_zip_package.clear()
+        reset_conversion()
         st.success("Cache cleared successfully")
     
     # Credits
@@ -277,78 +375,164 @@ if uploaded_file:
         status = st.empty()
         
         try:
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp:
-                tmp.write(uploaded_file.getvalue())
-                tmp_path = tmp.name
-            
-            # Extraction
-            status.text("Extracting document structure...")
-            progress.progress(20)
-            
-            structure, image_data = extract_document_structure(tmp_path)
-            
-            status.text(f"{len(structure)} elements detected")
-            progress.progress(40)
-            
-            # Save images
-            status.text("Extracting images...")
-            outputs_dir = Path("outputs")
-            outputs_dir.mkdir(exist_ok=True)
-            images_dir = outputs_dir / "images"
-            
-            image_urls = save_images(image_data, str(images_dir), base_url)
-            progress.progress(60)
-            
-            # Build JSON
-            status.text("Generating Elementor JSON...")
-            elementor_json = build_elementor_json(
-                structure, 
-                image_data, 
-                image_urls,
-                num_columns=num_columns,
-                distribution_strategy=distribution_strategy
-            )
-            progress.progress(80)
-            
-            # Save JSON
-            json_output = json.dumps(elementor_json, ensure_ascii=False, indent=2)
-            st.session_state.json_data = json_output
-            
+            # Isolated workspace for this conversion
+            workspaces = get_workspaces()
+            job_id = workspaces.create()
+            st.session_state.jobs.append(job_id)
+            images_dir = Path(workspaces.images_dir(job_id))
             json_filename = f"{st.session_state.filename}_elementor.json"
-            json_path = outputs_dir / json_filename
-            with open(json_path, 'w', encoding='utf-8') as f:
-                f.write(json_output)
-            
-            # Statistics
-            h_count = sum(1 for item in structure if item['type'] in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-            p_count = sum(1 for item in structure if item['type'] == 'p')
-            img_count = len(image_data)
-            tbl_count = sum(1 for item in structure if item['type'] == 'table')
-            
-            st.session_state.stats = {
-                'headings': h_count,
-                'paragraphs': p_count,
-                'images': img_count,
-                'tables': tbl_count,
-                'total': len(structure),
-                'layout': f"{num_columns} column{'s' if num_columns > 1 else ''}",
-                'strategy': distribution_strategy if num_columns > 1 else 'N/A'
-            }
+            json_path = Path(workspaces.path(job_id)) / json_filename
+            package_path = Path(workspaces.path(job_id)) / PACKAGE_FILENAME
+            package_zip = None
             
-            progress.progress(100)
-            status.text("Conversion completed successfully")
-            st.session_state.converted = True
+            # Identical document + options: serve the cached result
+            conversion_cache = get_conversion_cache()
+            docx_bytes = uploaded_file.getvalue()
+            cache_key = ConversionCache.make_key(docx_bytes, {
+                'num_columns': num_columns,
+                'distribution_strategy': distribution_strategy,
+                'base_url': base_url,
+                'compact': compact_json,
+                'image_options': image_options,
+            })
+            cached = conversion_cache.get(cache_key)
             
-            os.unlink(tmp_path)
+            if cached is not None:
+                status.text("Loading cached conversion...")
+                ConversionCache.restore(cached, str(images_dir), str(json_path))
+                st.session_state.conversion_id = cache_key
+                st.session_state.job_id = job_id
+                st.session_state.json_path = str(json_path)
+                st.session_state.stats = cached['meta']['stats']
+                
+                progress.progress(100)
+                status.text("Conversion completed successfully (cached)")
+                st.session_state.converted = True
+            else:
+                # Parsed structure + saved images only depend on the document,
+                # base URL and image options: a layout change reuses them without re-parsing
+                parsed_key = (hashlib.sha256(docx_bytes).hexdigest(), base_url, json.dumps(image_options, sort_keys=True))
+                parsed = st.session_state.parsed_documents.get(parsed_key)
+                if parsed is not None:
+                    parsed_images_dir = Path(parsed['images_dir'])
+                    if not all((parsed_images_dir / name).exists() for name in parsed['image_files']):
+                        parsed = None
+                
+                if parsed is not None:
+                    status.text("Reusing parsed document...")
+                    structure = parsed['structure']
+                    image_data = parsed['image_data']
+                    image_urls = parsed['image_urls']
+                    image_files = parsed['image_files']
+                    # Images of the previous job are linked into the new workspace
+                    for name in image_files:
+                        MediaStore.materialize(str(parsed_images_dir / name), str(images_dir / name))
+                    progress.progress(60)
+                else:
+                    # Extraction (the upload buffer is parsed in place, no temporary file)
+                    status.text("Extracting document structure...")
+                    progress.progress(20)
+                    
+                    # Images are written (and added to the package ZIP) by a
+                    # thread pool while the document is still being parsed
+                    if create_zip:
+                        package_zip = zipfile.ZipFile(package_path, 'w', zipfile.ZIP_DEFLATED)
+                    try:
+                        # Images are stored once in the shared media store and hard-linked here
+                        structure, image_data, image_urls = extract_and_save(
+                            docx_bytes, str(images_dir), base_url,
+                            store=get_media_store(), conversion_id=job_id,
+                            image_options=image_options, zip_file=package_zip
+                        )
+                    finally:
+                        if package_zip is not None:
+                            package_zip.close()
+                    
+                    status.text(f"{len(structure)} elements detected")
+                    progress.progress(60)
+                    
+                    # Keep the intermediate artifact without image bytes (already on disk)
+                    image_data = {
+                        ref_id: {key: value for key, value in info.items() if key != 'blob'}
+                        for ref_id, info in image_data.items()
+                    }
+                    image_files = {os.path.basename(url) for url in image_urls.values()}
+                    image_files.update(
+                        variant['file'] for info in image_data.values() for variant in info.get('variants', [])
+                    )
+                    st.session_state.parsed_documents[parsed_key] = {
+                        'structure': structure,
+                        'image_data': image_data,
+                        'image_urls': image_urls,
+                        'image_files': image_files,
+                        'images_dir': str(images_dir),
+                    }
+                    while len(st.session_state.parsed_documents) > MAX_PARSED_DOCUMENTS:
+                        oldest_key = next(iter(st.session_state.parsed_documents))
+                        del st.session_state.parsed_documents[oldest_key]
+                
+                # Build JSON
+                status.text("Generating Elementor JSON...")
+                elementor_json = build_elementor_json(
+                    structure, 
+                    image_data, 
+                    image_urls,
+                    num_columns=num_columns,
+                    distribution_strategy=distribution_strategy
+                )
+                progress.progress(80)
+                
+                # Save JSON (streamed to disk, never held as one string)
+                save_json(elementor_json, str(json_path), compact=compact_json)
+                if package_zip is not None:
+                    # The images are already in the package: only the JSON is appended
+                    with zipfile.ZipFile(package_path, 'a', zipfile.ZIP_DEFLATED) as zf:
+                        zf.write(json_path, json_path.name)
+                st.session_state.conversion_id = cache_key
+                st.session_state.job_id = job_id
+                st.session_state.json_path = str(json_path)
+                
+                # Statistics
+                h_count = sum(1 for item in structure if item['type'] in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+                p_count = sum(1 for item in structure if item['type'] == 'p')
+                img_count = len(image_data)
+                tbl_count = sum(1 for item in structure if item['type'] == 'table')
+                
+                st.session_state.stats = {
+                    'headings': h_count,
+                    'paragraphs': p_count,
+                    'images': img_count,
+                    'tables': tbl_count,
+                    'total': len(structure),
+                    'layout': f"{num_columns} column{'s' if num_columns > 1 else ''}",
+                    'strategy': distribution_strategy if num_columns > 1 else 'N/A'
+                }
+                
+                conversion_cache.put(
+                    cache_key,
+                    str(json_path),
+                    str(images_dir),
+                    {'stats': st.session_state.stats},
+                    image_names=image_files
+                )
+                
+                progress.progress(100)
+                status.text("Conversion completed successfully")
+                st.session_state.converted = True
             
         except Exception as e:
             st.error(f"Error during conversion: {str(e)}")
-            if 'tmp_path' in locals() and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
 
 # Results
-if st.session_state.converted and st.session_state.json_data:
+# st.fragment isolates the results area: a click there only reruns this function
+results_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+@results_fragment
+def show_results():
+    """Résultats de la conversion et téléchargements"""
+    # Viewing the results keeps the workspace alive
+    get_workspaces().touch(st.session_state.job_id)
+    
     st.markdown("---")
     
     # Conversion statistics
@@ -381,10 +565,12 @@ if st.session_state.converted and st.session_state.json_data:
     
     col_a, col_b = st.columns(2)
     
+    json_bytes = get_json_bytes(st.session_state.conversion_id, st.session_state.json_path)
+    
     with col_a:
         st.download_button(
             label="Download JSON",
-            data=st.session_state.json_data,
+            data=json_bytes,
             file_name=f"{st.session_state.filename}_elementor.json",
             mime="application/json",
             use_container_width=True,
@@ -393,24 +579,16 @@ if st.session_state.converted and st.session_state.json_data:
     
     with col_b:
         if create_zip:
-            outputs_dir = Path("outputs")
-            zip_buffer = BytesIO()
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                # JSON
-                json_path = outputs_dir / f"{st.session_state.filename}_elementor.json"
-                if json_path.exists():
-                    zf.write(json_path, json_path.name)
-                
-                # Images
-                images_dir = outputs_dir / "images"
-                if images_dir.exists():
-                    for img_file in images_dir.glob("*"):
-                        zf.write(img_file, f"images/{img_file.name}")
+            # Only this job's files: its JSON and its workspace images
+            zip_bytes = get_zip_package(
+                st.session_state.conversion_id,
+                st.session_state.json_path,
+                get_workspaces().images_dir(st.session_state.job_id)
+            )
             
             st.download_button(
                 label="Download ZIP Package",
-                data=zip_buffer.getvalue(),
+                data=zip_bytes,
                 file_name=f"{st.session_state.filename}_package.zip",
                 mime="application/zip",
                 use_container_width=True,
@@ -437,8 +615,12 @@ if st.session_state.converted and st.session_state.json_data:
     
     # JSON preview
     with st.expander("JSON Preview"):
-        preview = st.session_state.json_data[:1500]
+        preview = json_bytes[:1500].decode('utf-8', errors='ignore')
         st.code(preview + "\n...", language='json')
 
+
+if st.session_state.converted and st.session_state.json_path and os.path.exists(st.session_state.json_path):
+    show_results()
+
 # Footer with credits
 show_credits_footer()
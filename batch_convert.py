@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+batch_convert.py - Conversion par lots de documents .docx en JSON Elementor
+
+Parcourt des dossiers ou motifs glob et convertit chaque document
+(extract_and_save → build_elementor_json) dans un
+pool de processus. Chaque document obtient son dossier de sortie
+(JSON + images) et un manifeste récapitulatif est écrit à la racine.
+
+Usage:
+    python batch_convert.py docs/ "archives/**/*.docx" -o outputs/batch -j 8
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from word_processor import extract_and_save
+from json_builder import build_elementor_json
+from json_writer import save_json
+from conversion_cache import ConversionCache
+import image_pipeline
+from image_store import ImageStore, DEFAULT_SPILL_THRESHOLD
+from media_store import MediaStore
+from incremental import build_incremental, load_state, save_state
+import conversion_cache
+
+
+def collect_documents(inputs: List[str]) -> List[Path]:
+    """Résout dossiers (récursivement), fichiers et motifs glob en liste de .docx"""
+    documents = []
+    seen = set()
+
+    for pattern in inputs:
+        path = Path(pattern)
+        if path.is_dir():
+            candidates = sorted(path.rglob('*.docx'))
+        elif path.is_file():
+            candidates = [path]
+        else:
+            candidates = sorted(Path(p) for p in glob.glob(pattern, recursive=True))
+
+        for candidate in candidates:
+            # Ignorer les fichiers verrous de Word (~$document.docx)
+            if candidate.suffix.lower() != '.docx' or candidate.name.startswith('~$'):
+                continue
+            resolved = candidate.resolve()
+            if resolved not in seen:
+                seen.add(resolved)
+                documents.append(candidate)
+
+    return documents
+
+
+def assign_output_dirs(documents: List[Path], output_root: Path) -> List[Path]:
+    """Un dossier de sortie par document, suffixé si deux documents ont le même nom"""
+    used = {}
+    output_dirs = []
+    for document in documents:
+        stem = document.stem
+        count = used.get(stem, 0)
+        used[stem] = count + 1
+        output_dirs.append(output_root / (stem if count == 0 else f"{stem}_{count + 1}"))
+    return output_dirs
+
+
+def conversion_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Options qui déterminent le résultat (clé du cache de conversion)"""
+    image_options = options.get('image_options')
+    if image_options is not None:
+        # Le nombre de threads d'encodage ne change pas le résultat
+        image_options = {key: value for key, value in image_options.items() if key != 'workers'}
+    return {
+        'num_columns': options['num_columns'],
+        'distribution_strategy': options['distribution_strategy'],
+        'base_url': options['base_url'],
+        'compact': options.get('compact', False),
+        'image_options': image_options,
+    }
+
+
+def convert_file(docx_path: str, output_dir: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convertit un document (exécuté dans un processus du pool)
+
+    Returns:
+        dict: Entrée du manifeste pour ce document
+    """
+    start = time.perf_counter()
+    entry = {'source': docx_path, 'output_dir': output_dir}
+    json_path = os.path.join(output_dir, f"{Path(docx_path).stem}_elementor.json")
+    state_path = os.path.join(output_dir, f"{Path(docx_path).stem}_elementor.state.json")
+    patch_path = os.path.join(output_dir, f"{Path(docx_path).stem}_elementor.patch.json")
+    images_dir = os.path.join(output_dir, 'images')
+
+    try:
+        cache = None
+        # En mode incrémental, le résultat dépend de l'état précédent : pas de cache
+        if options.get('cache_dir') and not options.get('incremental'):
+            cache = ConversionCache(options['cache_dir'], max_bytes=options['cache_max_bytes'])
+            cache_key = ConversionCache.make_key(docx_path, conversion_options(options))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                os.makedirs(output_dir, exist_ok=True)
+                ConversionCache.restore(cached, images_dir, json_path)
+                entry.update({'status': 'ok', 'cached': True, 'json': json_path, **cached['meta'].get('stats', {})})
+                entry['seconds'] = round(time.perf_counter() - start, 3)
+                return entry
+
+        # Images écrites en parallèle pendant la lecture du document
+        os.makedirs(output_dir, exist_ok=True)
+        # Images au-delà du seuil gardées dans des fichiers temporaires, pas en mémoire
+        image_store = ImageStore(options.get('spill_threshold', DEFAULT_SPILL_THRESHOLD))
+        # Stockage partagé : une image commune à plusieurs documents n'est stockée qu'une fois
+        store = MediaStore(options['media_store']) if options.get('media_store') else None
+        structure, image_data, image_urls = extract_and_save(
+            docx_path, images_dir, options['base_url'],
+            store=store,
+            image_options=options.get('image_options'),
+            image_store=image_store
+        )
+
+        patch = None
+        if options.get('incremental'):
+            elementor_json, state, patch = build_incremental(
+                structure,
+                image_data,
+                image_urls,
+                load_state(state_path),
+                num_columns=options['num_columns'],
+                distribution_strategy=options['distribution_strategy']
+            )
+            save_state(state_path, state)
+            with open(patch_path, 'w', encoding='utf-8') as f:
+                json.dump(patch, f, ensure_ascii=False, indent=2)
+        else:
+            elementor_json = build_elementor_json(
+                structure,
+                image_data,
+                image_urls,
+                num_columns=options['num_columns'],
+                distribution_strategy=options['distribution_strategy']
+            )
+
+        save_json(elementor_json, json_path, compact=options.get('compact', False))
+
+        stats = {
+            'elements': len(structure),
+            'headings': sum(1 for item in structure if item['type'] in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']),
+            'paragraphs': sum(1 for item in structure if item['type'] == 'p'),
+            'images': len(image_data),
+            'tables': sum(1 for item in structure if item['type'] == 'table'),
+        }
+
+        if cache is not None:
+            # Seulement les images de cette conversion : le dossier peut contenir
+            # celles d'une conversion précédente du même document
+            image_names = {os.path.basename(url) for url in image_urls.values()}
+            image_names.update(
+                variant['file'] for info in image_data.values() for variant in info.get('variants', [])
+            )
+            cache.put(cache_key, json_path, images_dir, {'stats': stats}, image_names=image_names)
+
+        entry.update({'status': 'ok', 'cached': False, 'json': json_path, **stats})
+        if patch is not None:
+            entry.update({'patch': patch_path, 'reused': patch['reused'], 'rebuilt': patch['rebuilt']})
+    except Exception as e:
+        entry.update({'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run_batch(
+    documents: List[Path],
+    output_root: Path,
+    options: Dict[str, Any],
+    workers: int,
+    verbose: bool = False
+) -> Dict[str, Any]:
+    """
+    Convertit tous les documents dans un pool de processus et écrit le manifeste
+
+    Un processus qui meurt (mémoire, crash d'une bibliothèque native) casse le
+    pool : ses documents et ceux qui n'ont pas pu être lancés sont notés en
+    échec, et le manifeste est écrit quand même.
+    """
+    output_root.mkdir(parents=True, exist_ok=True)
+    output_dirs = assign_output_dirs(documents, output_root)
+
+    start = time.perf_counter()
+    results = []
+    futures = {}
+
+    def failed_entry(document: Path, output_dir: Path, error: BaseException) -> Dict[str, Any]:
+        return {
+            'source': str(document),
+            'output_dir': str(output_dir),
+            'status': 'error',
+            'error': f"{type(error).__name__}: {error}",
+        }
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for document, output_dir in zip(documents, output_dirs):
+                future = executor.submit(convert_file, str(document), str(output_dir), options)
+                futures[future] = (document, output_dir)
+
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    entry = future.result()
+                except BrokenProcessPool as e:
+                    entry = failed_entry(*futures[future], e)
+                results.append(entry)
+                if verbose or entry['status'] != 'ok':
+                    if entry['status'] != 'ok':
+                        status = f"❌ {entry.get('error')}"
+                    elif entry.get('cached'):
+                        status = "✅ (cache)"
+                    elif 'rebuilt' in entry:
+                        status = f"✅ ({entry['rebuilt']} blocs reconstruits, {entry['reused']} réutilisés)"
+                    else:
+                        status = "✅"
+                    print(f"[{done}/{len(documents)}] {entry['source']} {status}", file=sys.stderr)
+    except BrokenProcessPool as e:
+        # Pool cassé pendant les soumissions : les documents restants ne sont pas lancés
+        print(f"❌ Pool de processus interrompu: {e}", file=sys.stderr)
+        converted = {entry['source'] for entry in results}
+        for future, (document, output_dir) in futures.items():
+            if str(document) not in converted and future.done() and future.exception() is None:
+                results.append(future.result())
+                converted.add(str(document))
+        for document, output_dir in zip(documents, output_dirs):
+            if str(document) not in converted:
+                results.append(failed_entry(document, output_dir, e))
+
+    # Ordre du manifeste = ordre des documents en entrée
+    order = {str(document): idx for idx, document in enumerate(documents)}
+    results.sort(key=lambda entry: order[entry['source']])
+
+    manifest = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'options': options,
+        'workers': workers,
+        'total': len(results),
+        'succeeded': sum(1 for entry in results if entry['status'] == 'ok'),
+        'cached': sum(1 for entry in results if entry.get('cached')),
+        'failed': sum(1 for entry in results if entry['status'] != 'ok'),
+        'seconds': round(time.perf_counter() - start, 3),
+        'files': results,
+    }
+
+    with open(output_root / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    return manifest
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(
+        description="Convertit des dossiers de documents .docx en JSON Elementor"
+    )
+
+    parser.add_argument(
+        'inputs',
+        nargs='+',
+        help='Dossiers, fichiers .docx ou motifs glob (ex: "docs/**/*.docx")'
+    )
+
+    parser.add_argument(
+        '-o', '--output-dir',
+        type=str,
+        default=os.path.join('outputs', 'batch'),
+        help='Dossier de sortie (un sous-dossier par document + manifest.json)'
+    )
+
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Nombre de processus (défaut: tous les cœurs)'
+    )
+
+    parser.add_argument(
+        '-c', '--columns',
+        type=int,
+        default=1,
+        choices=[1, 2, 3],
+        help='Nombre de colonnes'
+    )
+
+    parser.add_argument(
+        '-d', '--distribution',
+        type=str,
+        default='auto',
+        choices=['auto', 'sequential', 'balanced'],
+        help='Stratégie de distribution du contenu'
+    )
+
+    parser.add_argument(
+        '-u', '--base-url',
+        type=str,
+        default='',
+        help='URL de base des médias WordPress'
+    )
+
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='JSON compact (sans indentation)'
+    )
+
+    parser.add_argument(
+        '--optimize-images',
+        action='store_true',
+        help='Redimensionne les images, les transcode en WebP et écrit plusieurs largeurs'
+    )
+
+    parser.add_argument(
+        '--max-width',
+        type=int,
+        default=image_pipeline.DEFAULT_MAX_WIDTH,
+        help='Largeur maximale des images optimisées (px)'
+    )
+
+    parser.add_argument(
+        '--image-widths',
+        type=str,
+        default=','.join(str(w) for w in image_pipeline.DEFAULT_WIDTHS),
+        help='Largeurs des variantes, séparées par des virgules'
+    )
+
+    parser.add_argument(
+        '--image-quality',
+        type=int,
+        default=image_pipeline.DEFAULT_QUALITY,
+        help='Qualité WebP/AVIF (0-100)'
+    )
+
+    parser.add_argument(
+        '--avif',
+        action='store_true',
+        help='Écrit aussi des variantes AVIF (si Pillow le supporte)'
+    )
+
+    parser.add_argument(
+        '--spill-kb',
+        type=int,
+        default=DEFAULT_SPILL_THRESHOLD // 1024,
+        help='Taille (Ko) au-delà de laquelle une image est gardée sur disque '
+             'plutôt qu\'en mémoire pendant la conversion'
+    )
+
+    parser.add_argument(
+        '--media-store',
+        type=str,
+        default=None,
+        help='Dossier du stockage d\'images partagé (images dédupliquées entre '
+             'documents, liées dans chaque dossier de sortie)'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=conversion_cache.DEFAULT_ROOT,
+        help='Dossier du cache de conversions'
+    )
+
+    parser.add_argument(
+        '--cache-max-mb',
+        type=int,
+        default=conversion_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+        help='Taille maximale du cache en Mo (éviction LRU)'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Désactive le cache de conversions'
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="Reconversion incrémentale : conserve les widgets (et leurs IDs) des blocs "
+             "inchangés depuis la conversion précédente et écrit un patch"
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Mode verbeux (affiche chaque document)'
+    )
+
+    args = parser.parse_args()
+
+    documents = collect_documents(args.inputs)
+    if not documents:
+        print("❌ Aucun document .docx trouvé", file=sys.stderr)
+        return 1
+
+    workers = max(1, min(args.workers, len(documents)))
+
+    image_options = None
+    if args.optimize_images:
+        # Les documents sont déjà répartis sur les processus : un thread d'encodage chacun
+        image_options = image_pipeline.default_options(
+            max_width=args.max_width,
+            widths=[int(w) for w in args.image_widths.split(',') if w.strip()],
+            quality=args.image_quality,
+            avif=args.avif,
+            workers=1 if workers > 1 else None
+        )
+    options = {
+        'num_columns': args.columns,
+        'distribution_strategy': args.distribution,
+        'base_url': args.base_url,
+        'compact': args.compact,
+        'image_options': image_options,
+        'cache_dir': None if args.no_cache else args.cache_dir,
+        'cache_max_bytes': args.cache_max_mb * 1024 * 1024,
+        'incremental': args.incremental,
+        'spill_threshold': args.spill_kb * 1024,
+        'media_store': args.media_store,
+    }
+
+    print(f"📄 {len(documents)} documents, {workers} processus", file=sys.stderr)
+
+    manifest = run_batch(documents, Path(args.output_dir), options, workers, args.verbose)
+
+    print(
+        f"✅ {manifest['succeeded']}/{manifest['total']} documents convertis "
+        f"en {manifest['seconds']}s → {Path(args.output_dir) / 'manifest.json'}",
+        file=sys.stderr
+    )
+
+    return 0 if manifest['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+conversion_cache.py - Cache disque des conversions terminées
+
+Clé = SHA-256 du fichier .docx + options de conversion (colonnes, stratégie,
+URL de base, layout). Une entrée contient le JSON Elementor final, les images
+et des métadonnées (statistiques) : une reconversion identique est servie
+sans rien reparser. Taille et nombre d'entrées bornés, éviction LRU.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Optional, Union
+
+
+DEFAULT_ROOT = os.path.join("outputs", "cache")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 Go
+DEFAULT_MAX_ENTRIES = 500
+
+# Incrémenter quand le format de sortie change pour invalider les anciennes entrées
+CACHE_VERSION = 1
+
+JSON_FILENAME = "elementor.json"
+IMAGES_DIRNAME = "images"
+META_FILENAME = "meta.json"
+
+
+def _copy_tree(src: str, dest: str, names: Optional[Iterable[str]] = None):
+    """Copie un dossier d'images (ou seulement `names`) par liens physiques, copie en repli"""
+    os.makedirs(dest, exist_ok=True)
+    for name in (os.listdir(src) if names is None else names):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if not os.path.isfile(src_path) or os.path.exists(dest_path):
+            continue
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copyfile(src_path, dest_path)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class ConversionCache:
+    """Cache LRU des conversions, adressé par contenu du document et options"""
+
+    def __init__(
+        self,
+        root: str = DEFAULT_ROOT,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entries: int = DEFAULT_MAX_ENTRIES
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(docx: Union[str, bytes], options: Dict[str, Any]) -> str:
+        """
+        Clé de cache : SHA-256 du document (chemin ou contenu) + options
+        Les options sont sérialisées triées : l'ordre des clés n'importe pas.
+        """
+        digest = hashlib.sha256()
+        if isinstance(docx, (bytes, bytearray, memoryview)):
+            digest.update(docx)
+        else:
+            with open(docx, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+
+        options_json = json.dumps(options, sort_keys=True, ensure_ascii=False)
+        digest.update(f"\0v{CACHE_VERSION}\0{options_json}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Retourne l'entrée {'json_path', 'images_dir', 'meta'} ou None
+        Le JSON n'est pas chargé en mémoire (voir restore).
+        L'accès rafraîchit la date d'utilisation (LRU).
+        """
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, META_FILENAME)
+        json_path = os.path.join(entry_dir, JSON_FILENAME)
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(json_path):
+            return None
+
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+        return {
+            'json_path': json_path,
+            'images_dir': os.path.join(entry_dir, IMAGES_DIRNAME),
+            'meta': meta,
+        }
+
+    def put(
+        self,
+        key: str,
+        json_path: str,
+        images_dir: Optional[str] = None,
+        meta: Optional[Dict[str, Any]] = None,
+        image_names: Optional[Iterable[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Enregistre une conversion terminée puis applique les limites du cache
+
+        Args:
+            json_path: Fichier JSON produit par la conversion (copié, jamais relu en mémoire)
+            image_names: Fichiers de images_dir appartenant à cette conversion
+                (par défaut tout le dossier)
+        """
+        entry_dir = self._entry_dir(key)
+        parent = os.path.dirname(entry_dir)
+        os.makedirs(parent, exist_ok=True)
+
+        # Construction dans un dossier temporaire puis renommage atomique
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp_")
+        try:
+            shutil.copyfile(json_path, os.path.join(tmp_dir, JSON_FILENAME))
+
+            tmp_images = os.path.join(tmp_dir, IMAGES_DIRNAME)
+            if images_dir and os.path.isdir(images_dir):
+                _copy_tree(images_dir, tmp_images, image_names)
+            else:
+                os.makedirs(tmp_images)
+
+            entry_meta = dict(meta or {})
+            entry_meta['created_at'] = time.time()
+            entry_meta['size'] = _dir_size(tmp_dir)
+            with open(os.path.join(tmp_dir, META_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(entry_meta, f, ensure_ascii=False)
+
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Un autre processus a pu écrire la même entrée entre-temps
+            if not os.path.exists(entry_dir):
+                raise
+
+        self.evict()
+        return self.get(key)
+
+    @staticmethod
+    def restore(entry: Dict[str, Any], images_dir: str, json_path: Optional[str] = None):
+        """
+        Expose les images d'une entrée dans images_dir (liens physiques)
+        et copie son JSON vers json_path si demandé
+        """
+        if os.path.isdir(entry['images_dir']):
+            _copy_tree(entry['images_dir'], images_dir)
+        if json_path is not None:
+            shutil.copyfile(entry['json_path'], json_path)
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées au-delà des limites"""
+        entries = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                meta_path = os.path.join(prefix_dir, key, META_FILENAME)
+                try:
+                    last_access = os.path.getmtime(meta_path)
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        size = json.load(f).get('size', 0)
+                except (OSError, ValueError):
+                    continue
+                entries.append((last_access, size, os.path.join(prefix_dir, key)))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        count = len(entries)
+
+        for _, size, entry_dir in entries:
+            if total_bytes <= self.max_bytes and count <= self.max_entries:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+            count -= 1
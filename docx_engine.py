@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+docx_engine.py - Moteur d'extraction DOCX unique (une seule lecture)
+Parcourt word/document.xml directement depuis l'archive avec lxml (iterparse)
+et libère chaque sous-arbre après lecture : mémoire constante quelle que soit
+la taille du document.
+
+Produit en un seul passage le texte, les styles/titres, les tableaux, les images
+et les positions. word_processor, text_extractor, image_extractor et
+word_to_elementor ne sont que des adaptateurs au-dessus de ce moteur.
+"""
+
+import os
+import posixpath
+import sys
+import zipfile
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Union
+
+from lxml import etree
+
+import image_probe
+from image_store import ImageStore
+
+
+# Espaces de noms OOXML
+NS = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'pic': 'http://schemas.openxmlformats.org/drawingml/2006/picture',
+    'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing',
+}
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+
+def _w(tag: str) -> str:
+    return f"{{{NS['w']}}}{tag}"
+
+
+W_BODY = _w('body')
+W_P = _w('p')
+W_TBL = _w('tbl')
+W_TR = _w('tr')
+W_TC = _w('tc')
+W_R = _w('r')
+W_HYPERLINK = _w('hyperlink')
+W_T = _w('t')
+W_TAB = _w('tab')
+W_PTAB = _w('ptab')
+W_BR = _w('br')
+W_CR = _w('cr')
+W_NO_BREAK_HYPHEN = _w('noBreakHyphen')
+W_VAL = _w('val')
+W_TYPE = _w('type')
+
+# Noms de styles internes → noms affichés (même correspondance que python-docx)
+_UI_STYLE_NAMES = {
+    'caption': 'Caption',
+    'footer': 'Footer',
+    'header': 'Header',
+    **{f'heading {n}': f'Heading {n}' for n in range(1, 10)},
+}
+
+
+def _run_text(run: etree._Element) -> str:
+    """Texte d'un run, avec la même traduction que python-docx (tab, br, ...)"""
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or '')
+        elif tag in (W_TAB, W_PTAB):
+            parts.append('\t')
+        elif tag == W_BR:
+            br_type = child.get(W_TYPE)
+            parts.append('\n' if br_type in (None, 'textWrapping') else '')
+        elif tag == W_CR:
+            parts.append('\n')
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append('-')
+    return ''.join(parts)
+
+
+def paragraph_text(p: etree._Element) -> str:
+    """Texte d'un paragraphe w:p (runs directs et hyperliens)"""
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            parts.append(_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(_run_text(r) for r in child.iterchildren(W_R))
+    return ''.join(parts)
+
+
+def _cell_text(tc: etree._Element) -> str:
+    return '\n'.join(paragraph_text(p) for p in tc.iterchildren(W_P))
+
+
+def _int_val(parent: etree._Element, path: str, default: int) -> int:
+    found = parent.find(path, NS)
+    if found is None:
+        return default
+    try:
+        return int(found.get(W_VAL, default))
+    except ValueError:
+        return default
+
+
+def read_table(tbl: etree._Element) -> Dict[str, List[List[Any]]]:
+    """
+    Lit un tableau w:tbl en parcourant directement w:tr/w:tc (temps linéaire)
+    
+    Returns:
+        dict:
+        - rows: grille de textes ; une cellule fusionnée horizontalement est
+          répétée sur chaque colonne couverte, une cellule fusionnée
+          verticalement reprend le texte de la cellule d'origine (même grille
+          que row.cells de python-docx)
+        - cells: cellules d'origine seulement, par ligne, avec leurs fusions
+          [{'text', 'colspan', 'rowspan'}, ...]
+    """
+    rows = []
+    cells = []
+    # Cellule d'origine ouverte pour chaque position de grille de la ligne précédente
+    above: Dict[int, Dict[str, Any]] = {}
+
+    for tr in tbl.iterchildren(W_TR):
+        row_texts = []
+        row_cells = []
+        current: Dict[int, Dict[str, Any]] = {}
+        offset = _int_val(tr, 'w:trPr/w:gridBefore', 0)
+
+        for tc in tr.iterchildren(W_TC):
+            span = max(_int_val(tc, 'w:tcPr/w:gridSpan', 1), 1)
+            v_merge = tc.find('w:tcPr/w:vMerge', NS)
+            is_continue = v_merge is not None and v_merge.get(W_VAL, 'continue') == 'continue'
+
+            if is_continue and offset in above:
+                origin = above[offset]
+                origin['rowspan'] += 1
+            else:
+                origin = {'text': _cell_text(tc), 'colspan': span, 'rowspan': 1}
+                row_cells.append(origin)
+
+            row_texts.extend([origin['text']] * origin['colspan'])
+            current[offset] = origin
+            offset += span
+
+        rows.append(row_texts)
+        cells.append(row_cells)
+        above = current
+
+    return {'rows': rows, 'cells': cells}
+
+
+def table_rows(tbl: etree._Element) -> List[List[str]]:
+    """Grille de textes d'un tableau (voir read_table)"""
+    return read_table(tbl)['rows']
+
+
+# Document en entrée : chemin, contenu en mémoire ou flux binaire (ex: fichier téléversé)
+DocxInput = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+def open_input(source: DocxInput) -> Union[str, os.PathLike, BinaryIO]:
+    """
+    Objet lisible par zipfile sans passer par un fichier temporaire
+    - chemin : tel quel
+    - bytes / bytearray / memoryview : lu en place via BytesIO
+    - flux positionnable : tel quel (non fermé par le paquet)
+    - flux non positionnable : lu en mémoire
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    if hasattr(source, 'read'):
+        seekable = getattr(source, 'seekable', None)
+        if seekable is not None and seekable():
+            return source
+        return BytesIO(source.read())
+    raise TypeError(f"Source DOCX non supportée: {type(source).__name__}")
+
+
+class DocxPackage:
+    """
+    Accès paresseux aux parties d'un paquet DOCX (relations, styles, médias)
+    sans charger le document entier en mémoire
+    """
+
+    def __init__(self, source: DocxInput, image_store: Optional[ImageStore] = None):
+        self.zip = zipfile.ZipFile(open_input(source))
+        # Images au-delà du seuil copiées de l'archive vers le disque, pas en mémoire
+        self.image_store = image_store if image_store is not None else ImageStore()
+        self.document_part = self._find_document_part()
+        self.rels = self._read_rels(self.document_part)
+        self._styles: Optional[Dict[str, Any]] = None
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _find_document_part(self) -> str:
+        try:
+            root = etree.fromstring(self.zip.read('_rels/.rels'))
+        except KeyError:
+            return 'word/document.xml'
+        for rel in root.iterchildren(f'{{{PKG_REL_NS}}}Relationship'):
+            if rel.get('Type') == OFFICE_DOCUMENT_REL:
+                return rel.get('Target').lstrip('/')
+        return 'word/document.xml'
+
+    def _read_rels(self, part_name: str) -> Dict[str, Dict[str, Any]]:
+        """Relations d'une partie : {rId: {'type', 'target', 'external'}}"""
+        base_dir, filename = posixpath.split(part_name)
+        rels_name = posixpath.join(base_dir, '_rels', f'{filename}.rels')
+        try:
+            root = etree.fromstring(self.zip.read(rels_name))
+        except KeyError:
+            return {}
+
+        rels = {}
+        for rel in root.iterchildren(f'{{{PKG_REL_NS}}}Relationship'):
+            target = rel.get('Target', '')
+            external = rel.get('TargetMode') == 'External'
+            if not external:
+                if target.startswith('/'):
+                    target = target.lstrip('/')
+                else:
+                    target = posixpath.normpath(posixpath.join(base_dir, target))
+            rels[rel.get('Id')] = {
+                'type': rel.get('Type', ''),
+                'target_ref': rel.get('Target', ''),
+                'target': target,
+                'external': external,
+            }
+        return rels
+
+    def image_rels(self) -> Dict[str, Dict[str, Any]]:
+        """Relations d'images du document principal"""
+        return {rel_id: rel for rel_id, rel in self.rels.items() if 'image' in rel['target_ref']}
+
+    def read_part(self, rel: Dict[str, Any]) -> bytes:
+        """Contenu binaire de la cible d'une relation interne"""
+        if rel['external']:
+            raise ValueError(f"Image liée externe non embarquée: {rel['target_ref']}")
+        return self.zip.read(rel['target'])
+
+    def read_image(self, rel_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lit une image du document : {'rel_id', 'blob', 'format', 'width', 'height'}
+        'blob' est une poignée image_store.ImageBlob (mémoire ou fichier
+        temporaire selon la taille). Format et dimensions viennent de l'en-tête
+        (image_probe), sans décodage.
+        Retourne None (avec message) si l'image est illisible.
+        """
+        try:
+            rel = self.rels[rel_id]
+            if rel['external']:
+                raise ValueError(f"Image liée externe non embarquée: {rel['target_ref']}")
+            member = self.zip.getinfo(rel['target'])
+            with self.zip.open(member) as stream:
+                blob = self.image_store.add_stream(stream, member.file_size)
+        except Exception as e:
+            print(f"Erreur extraction image {rel_id}: {e}", file=sys.stderr)
+            return None
+
+        with blob.view() as buffer:
+            info = image_probe.probe(buffer)
+        if info is None:
+            print(f"Erreur extraction image {rel_id}: format non reconnu", file=sys.stderr)
+            return None
+        return {'rel_id': rel_id, 'blob': blob, **info}
+
+    def _load_styles(self) -> Dict[str, Any]:
+        """
+        Lit styles.xml une seule fois et précalcule, pour chaque style de
+        paragraphe, son nom affiché et son niveau de titre (héritage w:basedOn
+        et w:outlineLvl résolus) : consultation O(1) par paragraphe
+        """
+        styles = {'names': {}, 'default': None, 'levels': {}}
+        styles_rel = next(
+            (rel for rel in self.rels.values() if rel['type'].endswith('/styles') and not rel['external']),
+            None
+        )
+        if styles_rel is None:
+            return styles
+
+        try:
+            root = etree.fromstring(self.zip.read(styles_rel['target']))
+        except KeyError:
+            return styles
+
+        based_on = {}
+        own_levels = {}
+        for style in root.iterchildren(_w('style')):
+            if style.get(W_TYPE) != 'paragraph':
+                continue
+            style_id = style.get(_w('styleId'))
+            name_el = style.find('w:name', NS)
+            name = name_el.get(W_VAL) if name_el is not None else None
+            name = _UI_STYLE_NAMES.get(name, name)
+            styles['names'][style_id] = name
+            if style.get(_w('default')) in ('1', 'true', 'on') and styles['default'] is None:
+                styles['default'] = style_id
+
+            parent = style.find('w:basedOn', NS)
+            if parent is not None:
+                based_on[style_id] = parent.get(W_VAL)
+
+            # Niveau propre : w:outlineLvl explicite, sinon nom du style
+            outline_level = _outline_level(style.find('w:pPr', NS))
+            if outline_level is not _UNSET:
+                own_levels[style_id] = outline_level
+            elif name:
+                level = style_heading_level(name)
+                if level:
+                    own_levels[style_id] = level
+
+        def resolve(style_id: str, seen: set) -> Optional[int]:
+            if style_id in styles['levels']:
+                return styles['levels'][style_id]
+            if style_id in own_levels:
+                return own_levels[style_id]
+            parent_id = based_on.get(style_id)
+            if parent_id is None or parent_id in seen or parent_id not in styles['names']:
+                return None
+            seen.add(parent_id)
+            return resolve(parent_id, seen)
+
+        for style_id in styles['names']:
+            styles['levels'][style_id] = resolve(style_id, {style_id})
+
+        return styles
+
+    @property
+    def styles(self) -> Dict[str, Any]:
+        if self._styles is None:
+            self._styles = self._load_styles()
+        return self._styles
+
+    def _resolved_style_id(self, style_id: Optional[str]) -> Optional[str]:
+        if style_id not in self.styles['names']:
+            return self.styles['default']
+        return style_id
+
+    def style_name(self, style_id: Optional[str]) -> str:
+        """Nom du style de paragraphe (style par défaut si absent ou inconnu)"""
+        return self.styles['names'].get(self._resolved_style_id(style_id)) or 'Normal'
+
+    def heading_level(self, style_id: Optional[str]) -> Optional[int]:
+        """Niveau de titre (1-6) du style de paragraphe, None pour du texte courant"""
+        return self.styles['levels'].get(self._resolved_style_id(style_id))
+
+    def iter_body(self) -> Iterator[etree._Element]:
+        """
+        Itère sur les enfants directs de w:body (w:p, w:tbl, ...) au fil de la lecture
+        Chaque élément est vidé dès que le consommateur passe au suivant.
+        """
+        with self.zip.open(self.document_part) as stream:
+            depth = 0
+            for event, elem in etree.iterparse(stream, events=('start', 'end'), huge_tree=True):
+                if event == 'start':
+                    depth += 1
+                    continue
+
+                depth -= 1
+                # document (0) > body (1) > enfant (2)
+                if depth == 2:
+                    yield elem
+                    elem.clear()
+                    parent = elem.getparent()
+                    while elem.getprevious() is not None:
+                        del parent[0]
+                    parent.remove(elem)
+                elif depth == 1 and elem.tag == W_BODY:
+                    elem.clear()
+
+
+_UNSET = object()
+
+
+def _outline_level(ppr: Optional[etree._Element]):
+    """
+    Niveau de titre donné par w:outlineLvl (0 → 1, ..., 5 → 6)
+    Retourne None pour le corps de texte ou un niveau > 6, _UNSET si absent.
+    """
+    if ppr is None:
+        return _UNSET
+    outline = ppr.find('w:outlineLvl', NS)
+    if outline is None:
+        return _UNSET
+    try:
+        level = int(outline.get(W_VAL)) + 1
+    except (TypeError, ValueError):
+        return _UNSET
+    return level if 1 <= level <= 6 else None
+
+
+def paragraph_style_id(p: etree._Element) -> Optional[str]:
+    style = p.find('w:pPr/w:pStyle', NS)
+    return style.get(W_VAL) if style is not None else None
+
+
+# Index XPath précompilés, partagés par tous les extracteurs (fonctionnent aussi
+# sur les éléments python-docx, qui sont des éléments lxml)
+_IMAGE_REL_IDS_XPATH = etree.XPath('.//a:blip/@r:embed | .//a:blip/@r:link', namespaces=NS)
+_PICTURE_XPATH = etree.XPath('boolean(.//pic:pic)', namespaces=NS)
+_DRAWING_XPATH = etree.XPath('.//wp:inline | .//wp:anchor', namespaces=NS)
+
+# 914400 EMU par pouce, 96 px par pouce
+EMU_PER_PIXEL = 9525
+
+
+def image_rel_ids(element: etree._Element) -> List[str]:
+    """
+    Tous les identifiants de relation d'images (a:blip/@r:embed et @r:link)
+    d'un élément, dans l'ordre du document, en un seul appel
+    """
+    return [str(rel_id) for rel_id in _IMAGE_REL_IDS_XPATH(element)]
+
+
+def has_picture(element: etree._Element) -> bool:
+    return _PICTURE_XPATH(element)
+
+
+def image_extents(element: etree._Element) -> Dict[str, Dict[str, int]]:
+    """
+    Taille d'affichage de chaque image d'un élément, lue dans wp:extent
+    (EMU convertis en pixels à 96 dpi) : {rel_id: {'display_width', 'display_height'}}
+    """
+    extents = {}
+    for drawing in _DRAWING_XPATH(element):
+        extent = drawing.find('wp:extent', NS)
+        if extent is None:
+            continue
+        try:
+            cx, cy = int(extent.get('cx', 0)), int(extent.get('cy', 0))
+        except ValueError:
+            continue
+        if cx <= 0 or cy <= 0:
+            continue
+        for rel_id in _IMAGE_REL_IDS_XPATH(drawing):
+            extents.setdefault(str(rel_id), {
+                'display_width': round(cx / EMU_PER_PIXEL),
+                'display_height': round(cy / EMU_PER_PIXEL),
+            })
+    return extents
+
+
+def style_heading_level(style_name: str) -> Optional[int]:
+    """Niveau de titre (1-6) déduit du nom de style Word, None pour un paragraphe"""
+    if 'Heading 1' in style_name or 'Title' in style_name:
+        return 1
+    for level in range(2, 7):
+        if f'Heading {level}' in style_name:
+            return level
+    return None
+
+
+class ParsedDocument:
+    """
+    Résultat d'une lecture complète : éléments du corps et images
+    Peut être passé à tous les adaptateurs (word_processor, text_extractor,
+    image_extractor, word_to_elementor) à la place d'un chemin pour ne lire
+    le paquet qu'une seule fois.
+    """
+
+    def __init__(self, elements: List[Dict[str, Any]], images: Dict[str, Dict[str, Any]]):
+        self.elements = elements
+        # {rel_id: image_info} dans l'ordre de première apparition
+        self.images = images
+
+
+# Tout ce qu'acceptent les adaptateurs : une entrée brute ou un document déjà lu
+DocxSource = Union[DocxInput, ParsedDocument]
+
+
+def _iter_package_elements(
+    package: DocxPackage,
+    image_cache: Optional[Dict[str, Any]] = None,
+    with_images: bool = True
+) -> Iterator[Dict[str, Any]]:
+    image_rels = package.image_rels()
+    paragraph_index = 0
+
+    for body_index, element in enumerate(package.iter_body()):
+        if element.tag == W_TBL:
+            record = {
+                'kind': 'table',
+                'body_index': body_index,
+                'paragraph_index': None,
+                **read_table(element),
+            }
+        elif element.tag == W_P:
+            style_id = paragraph_style_id(element)
+            heading_level = _outline_level(element.find('w:pPr', NS))
+            if heading_level is _UNSET:
+                heading_level = package.heading_level(style_id)
+            record = {
+                'kind': 'paragraph',
+                'body_index': body_index,
+                'paragraph_index': paragraph_index,
+                'text': paragraph_text(element),
+                'style': package.style_name(style_id),
+                'heading_level': heading_level,
+                'has_picture': has_picture(element),
+            }
+            paragraph_index += 1
+        else:
+            continue
+
+        # Images référencées par l'élément (une entrée par relation distincte),
+        # avec leur taille d'affichage dans cet élément
+        images = []
+        rel_ids = list(dict.fromkeys(image_rel_ids(element))) if with_images else []
+        extents = image_extents(element) if rel_ids else {}
+        for rel_id in rel_ids:
+            if rel_id not in image_rels:
+                continue
+            if image_cache is not None and rel_id in image_cache:
+                info = image_cache[rel_id]
+            else:
+                info = package.read_image(rel_id)
+                if image_cache is not None:
+                    image_cache[rel_id] = info
+            if info is not None:
+                if rel_id in extents:
+                    info = {**info, **extents[rel_id]}
+                images.append(info)
+        record['images'] = images
+
+        yield record
+
+
+def iter_elements(
+    source: DocxSource,
+    image_store: Optional[ImageStore] = None,
+    with_images: bool = True
+) -> Iterator[Dict[str, Any]]:
+    """
+    Itère sur les éléments du corps en un seul passage, sans les conserver
+    
+    Chaque élément est un dict :
+        - kind: 'paragraph' ou 'table'
+        - body_index: position parmi les enfants de w:body
+        - paragraph_index: position parmi les paragraphes (None pour un tableau)
+        - text, style, has_picture: pour les paragraphes
+        - heading_level: niveau de titre (1-6) issu des styles, ou None
+        - rows, cells: grille de textes et cellules fusionnées pour les tableaux
+        - images: images référencées [{'rel_id', 'blob', 'format', 'width', 'height',
+          'display_width', 'display_height'}] (taille d'affichage si wp:extent présent ;
+          'blob' : poignée image_store.ImageBlob)
+    
+    image_store fixe le seuil au-delà duquel les images vont sur disque
+    (par défaut image_store.DEFAULT_SPILL_THRESHOLD).
+    with_images=False : aucune image n'est lue ('images' reste vide,
+    has_picture est renseigné), pour les adaptateurs qui n'ont besoin que
+    du texte ou de la position des images.
+    Une relation d'image déjà rencontrée réutilise la même poignée 'blob'.
+    """
+    if isinstance(source, ParsedDocument):
+        yield from source.elements
+        return
+
+    with DocxPackage(source, image_store) as package:
+        # Une image répétée (logo, icône) n'est lue et déportée qu'une fois par passage
+        yield from _iter_package_elements(package, {}, with_images)
+
+
+def parse_docx(source: DocxSource, image_store: Optional[ImageStore] = None) -> ParsedDocument:
+    """Lit le document une seule fois (retourne tel quel un ParsedDocument)"""
+    if isinstance(source, ParsedDocument):
+        return source
+
+    image_cache: Dict[str, Any] = {}
+    with DocxPackage(source, image_store) as package:
+        elements = list(_iter_package_elements(package, image_cache))
+
+    images = {rel_id: info for rel_id, info in image_cache.items() if info is not None}
+    return ParsedDocument(elements, images)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+element_ids.py - IDs Elementor déterministes
+
+Un ID est dérivé d'une graine (empreinte du document) et du chemin de
+l'élément dans la page (ex: "widget/12", "section/column/0") : des entrées
+identiques produisent un JSON identique octet pour octet. Chaque construction
+tient l'ensemble des IDs déjà attribués ; une collision est résolue en
+redérivant l'ID avec un compteur.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Set
+
+from image_store import content_hash
+
+
+ID_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+ID_LENGTH = 7
+
+
+def _encode(digest: bytes) -> str:
+    """7 caractères [a-z0-9], comme les IDs générés par Elementor"""
+    value = int.from_bytes(digest, 'big')
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, remainder = divmod(value, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[remainder])
+    return ''.join(chars)
+
+
+def structure_seed(structure: List[Dict[str, Any]], image_data: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Graine par défaut : empreinte du contenu extrait du document
+    (éléments + empreintes des images)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(structure, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    for ref_id, img_info in sorted((image_data or {}).items()):
+        if 'hash' in img_info:
+            image_hash = img_info['hash']
+        elif 'blob' in img_info:
+            image_hash = img_info['blob'].hash()
+        else:
+            image_hash = content_hash(b'')
+        digest.update(f"\0{ref_id}:{image_hash}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ElementIds:
+    """Générateur d'IDs déterministes pour une construction de page"""
+
+    def __init__(self, seed: str):
+        self.seed = seed
+        self.used: Set[str] = set()
+        self.collisions = 0
+
+    def _derive(self, path: str, attempt: int) -> str:
+        key = f"{self.seed}\0{path}" if attempt == 0 else f"{self.seed}\0{path}\0{attempt}"
+        return _encode(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest())
+
+    def make(self, path: str) -> str:
+        """ID de l'élément situé à `path`, unique dans cette construction"""
+        attempt = 0
+        element_id = self._derive(path, attempt)
+        while element_id in self.used:
+            self.collisions += 1
+            attempt += 1
+            element_id = self._derive(path, attempt)
+        self.used.add(element_id)
+        return element_id
+
+    def reserve(self, element_id: str):
+        """Marque un ID existant (widget réutilisé) comme attribué"""
+        self.used.add(element_id)
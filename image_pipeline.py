@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+image_pipeline.py - Images responsives pour le web
+
+Optionnel : au lieu d'écrire les images telles que Word les a stockées
+(photos de 6000 px, captures PNG non compressées), chaque image est
+redimensionnée à une largeur maximale, transcodée en WebP (et AVIF si Pillow
+le supporte) et déclinée en plusieurs largeurs. L'encodage se fait dans un
+pool de threads (Pillow libère le GIL pendant le décodage, le
+redimensionnement et l'encodage).
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps, features
+
+from image_store import ImageBlob
+
+
+DEFAULT_MAX_WIDTH = 1920
+DEFAULT_WIDTHS = (480, 768, 1200)
+DEFAULT_QUALITY = 80
+
+# Formats matriciels que l'on peut transcoder sans perte de fonctionnalité
+# (les GIF animés et formats vectoriels sont conservés tels quels)
+TRANSCODABLE_FORMATS = {'JPEG', 'PNG', 'BMP', 'TIFF', 'WEBP'}
+
+EXTENSIONS = {'WEBP': 'webp', 'AVIF': 'avif'}
+
+# Tag EXIF Orientation ; 5 à 8 = rotation d'un quart de tour (largeur et hauteur permutées)
+ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def avif_supported() -> bool:
+    """AVIF disponible : Pillow >= 11.2 compilé avec libavif, ou plugin pillow-avif"""
+    try:
+        import pillow_avif  # noqa: F401
+        return True
+    except ImportError:
+        pass
+    try:
+        return bool(features.check('avif'))
+    except ValueError:
+        # Pillow trop ancien pour connaître la fonctionnalité
+        return False
+
+
+def default_options(**overrides) -> Dict[str, Any]:
+    """Options du pipeline (à passer à word_processor.save_images)"""
+    options = {
+        'max_width': DEFAULT_MAX_WIDTH,
+        'widths': list(DEFAULT_WIDTHS),
+        'quality': DEFAULT_QUALITY,
+        'avif': False,
+        'workers': None,
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return options
+
+
+def exif_orientation(img: Image.Image) -> int:
+    try:
+        return int(img.getexif().get(ORIENTATION_TAG, 1))
+    except Exception:
+        return 1
+
+
+def oriented_size(blob: ImageBlob, width: int, height: int) -> Tuple[int, int]:
+    """
+    Dimensions de l'image telle qu'affichée (après orientation EXIF)
+    Seul l'en-tête est lu ; en cas d'échec, dimensions stockées
+    """
+    try:
+        with blob.open() as stream, Image.open(stream) as img:
+            orientation = exif_orientation(img)
+    except Exception:
+        return width, height
+    return (height, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, height)
+
+
+def plan_variants(width: int, height: int, options: Dict[str, Any]) -> List[Tuple[int, int]]:
+    """
+    Dimensions des variantes : largeurs demandées inférieures à la largeur
+    plafonnée, plus la largeur plafonnée elle-même (jamais d'agrandissement)
+    width, height : dimensions orientées (voir oriented_size)
+    """
+    capped = min(width, options['max_width'])
+    widths = sorted({w for w in options['widths'] if w < capped} | {capped})
+    return [(w, max(1, round(height * w / width))) for w in widths]
+
+
+def output_formats(options: Dict[str, Any]) -> List[str]:
+    formats = ['WEBP']
+    if options.get('avif') and avif_supported():
+        formats.append('AVIF')
+    return formats
+
+
+def variant_filename(digest: str, width: int, image_format: str, quality: int) -> str:
+    """Nom immuable : même contenu, largeur, format et qualité = même fichier"""
+    return f"{digest}-{width}w-q{quality}.{EXTENSIONS[image_format]}"
+
+
+def can_transcode(img_info: Dict[str, Any]) -> bool:
+    return (
+        str(img_info.get('format', '')).upper() in TRANSCODABLE_FORMATS
+        and img_info.get('width', 0) > 0
+        and img_info.get('height', 0) > 0
+    )
+
+
+def encode_variants(
+    blob: ImageBlob,
+    sizes: List[Tuple[int, int]],
+    formats: List[str],
+    quality: int
+) -> List[Dict[str, Any]]:
+    """
+    Décode une image une fois et encode chaque (largeur, format)
+    sizes : dimensions orientées ; une largeur supérieure à celle de l'image
+    n'est pas produite (jamais d'agrandissement)
+
+    Returns:
+        list: [{'width', 'height', 'format', 'data'}]
+    """
+    # Lecture depuis la poignée : une image déportée sur disque n'est pas recopiée en mémoire
+    with blob.open() as stream:
+        img = Image.open(stream)
+        # JPEG : décodage directement à échelle réduite (beaucoup plus rapide sur les photos) ;
+        # draft travaille sur l'image stockée, avant réorientation
+        largest = sizes[-1]
+        if exif_orientation(img) in TRANSPOSED_ORIENTATIONS:
+            largest = largest[::-1]
+        img.draft('RGB', largest)
+        img = ImageOps.exif_transpose(img)
+        img.load()
+
+    if img.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = []
+    for width, _ in sizes:
+        if width > img.width:
+            continue
+        # Hauteur recalculée sur l'image réorientée (EXIF) pour garder ses proportions
+        height = max(1, round(img.height * width / img.width))
+        resized = img if img.size == (width, height) else img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for image_format in formats:
+            buffer = BytesIO()
+            if image_format == 'WEBP':
+                resized.save(buffer, 'WEBP', quality=quality, method=4)
+            else:
+                resized.save(buffer, image_format, quality=quality)
+            variants.append({
+                'width': width,
+                'height': height,
+                'format': image_format,
+                'data': buffer.getvalue()
+            })
+    if not variants:
+        raise ValueError(f"aucune variante plus petite que l'image ({img.width}px)")
+    return variants
+
+
+def process_images(
+    jobs: Dict[str, Dict[str, Any]],
+    options: Dict[str, Any],
+    output_folder: Optional[str] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Produit les variantes de plusieurs images dans un pool de threads
+
+    Args:
+        jobs: {empreinte: image_info} (une entrée par contenu distinct)
+        output_folder: Si toutes les variantes d'une image y existent déjà,
+            elle n'est pas réencodée
+
+    Returns:
+        dict: {empreinte: [{'file', 'width', 'height', 'format', 'data'?}]}
+            ('data' absent pour les variantes déjà présentes sur disque ;
+            image absente du résultat si elle n'a pas pu être traitée)
+    """
+    formats = output_formats(options)
+    quality = options['quality']
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    pending = {}
+
+    for digest, img_info in jobs.items():
+        width, height = oriented_size(img_info['blob'], img_info['width'], img_info['height'])
+        sizes = plan_variants(width, height, options)
+        planned = [
+            {'file': variant_filename(digest, w, fmt, quality), 'width': w, 'height': h, 'format': fmt}
+            for w, h in sizes for fmt in formats
+        ]
+        if output_folder and all(os.path.exists(os.path.join(output_folder, v['file'])) for v in planned):
+            results[digest] = planned
+        else:
+            pending[digest] = (img_info['blob'], sizes)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=options.get('workers') or os.cpu_count()) as executor:
+            futures = {
+                digest: executor.submit(encode_variants, blob, sizes, formats, quality)
+                for digest, (blob, sizes) in pending.items()
+            }
+            for digest, future in futures.items():
+                try:
+                    variants = future.result()
+                except Exception as e:
+                    # L'image d'origine sera conservée telle quelle
+                    print(f"⚠️  Optimisation impossible pour l'image {digest}: {e}", file=sys.stderr)
+                    continue
+                for variant in variants:
+                    variant['file'] = variant_filename(digest, variant['width'], variant['format'], quality)
+                results[digest] = variants
+
+    return results
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+image_probe.py - Format et dimensions d'une image sans la décoder
+
+Lit uniquement l'en-tête des formats courants (PNG, JPEG, GIF, BMP, WebP).
+Les autres formats (TIFF, EMF/WMF...) passent par PIL.Image.open, qui
+n'analyse lui aussi que l'en-tête : les pixels ne sont jamais décodés ici.
+Le décodage complet n'a lieu que si une transformation est demandée
+(voir image_pipeline).
+"""
+
+import mmap
+import struct
+from io import BytesIO
+from typing import Any, Dict, Optional, Union
+
+from PIL import Image
+
+
+# Marqueurs JPEG SOFn portant les dimensions (hors DHT, JPG et DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _probe_png(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 24 or data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return {'format': 'PNG', 'width': width, 'height': height}
+
+
+def _probe_gif(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 10:
+        return None
+    width, height = struct.unpack('<HH', data[6:10])
+    return {'format': 'GIF', 'width': width, 'height': height}
+
+
+def _probe_bmp(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 26:
+        return None
+    header_size = struct.unpack('<I', data[14:18])[0]
+    if header_size == 12:
+        width, height = struct.unpack('<HH', data[18:22])
+    else:
+        width, height = struct.unpack('<ii', data[18:26])
+    # Hauteur négative = image stockée de haut en bas
+    return {'format': 'BMP', 'width': width, 'height': abs(height)}
+
+
+def _probe_jpeg(data: bytes) -> Optional[Dict[str, Any]]:
+    offset = 2
+    size = len(data)
+    while offset + 9 < size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        # Octets de remplissage 0xFF
+        if marker == 0xFF:
+            offset += 1
+            continue
+        # Marqueurs sans segment (RSTn, TEM)
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            offset += 2
+            continue
+        segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return {'format': 'JPEG', 'width': width, 'height': height}
+        offset += 2 + segment_length
+    return None
+
+
+def _probe_webp(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b'VP8L':
+        bits = struct.unpack('<I', data[21:25])[0]
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+    else:
+        return None
+    return {'format': 'WEBP', 'width': width, 'height': height}
+
+
+def _probe_pil(data: Union[bytes, mmap.mmap]) -> Optional[Dict[str, Any]]:
+    # Image.open est paresseux : seul l'en-tête est lu. Une projection mmap est
+    # lue en place (read/seek) : la copier dans un BytesIO chargerait toute
+    # l'image déportée sur disque en mémoire.
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        fp = data
+    else:
+        fp = BytesIO(data)
+    try:
+        with Image.open(fp) as img:
+            return {'format': img.format or "PNG", 'width': img.width, 'height': img.height}
+    except Exception:
+        return None
+
+
+def probe(data: Union[bytes, mmap.mmap]) -> Optional[Dict[str, Any]]:
+    """
+    Format et dimensions intrinsèques d'une image : {'format', 'width', 'height'}
+    data peut être une projection mmap (image_store.FileBlob.view) : seules
+    les pages de l'en-tête sont alors lues.
+    Retourne None si le contenu n'est pas une image reconnue.
+    """
+    info = None
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            info = _probe_png(data)
+        elif data[:2] == b'\xff\xd8':
+            info = _probe_jpeg(data)
+        elif data[:6] in (b'GIF87a', b'GIF89a'):
+            info = _probe_gif(data)
+        elif data[:2] == b'BM':
+            info = _probe_bmp(data)
+        elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            info = _probe_webp(data)
+    except struct.error:
+        info = None
+
+    if info is None or info['width'] <= 0 or info['height'] <= 0:
+        return _probe_pil(data)
+    return info
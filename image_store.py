@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+image_store.py - Stockage temporaire des images d'une conversion
+
+Les images lues dans le document ne sont plus gardées en octets dans
+image_data : chaque image est un ImageBlob, une poignée paresseuse.
+Les petites images restent en mémoire ; au-delà du seuil, le contenu est
+copié directement de l'archive .docx vers un fichier temporaire et n'est
+relu qu'à la demande (flux ou projection mémoire mmap, jamais dans le tas).
+
+Les fichiers temporaires sont supprimés quand le dernier ImageBlob qui y
+fait référence disparaît (ou à l'appel de ImageStore.close()).
+"""
+
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Iterator, Optional, Union
+
+
+DEFAULT_SPILL_THRESHOLD = 1024 * 1024  # 1 Mo
+
+_COPY_BUFFER = 1024 * 1024
+
+
+def content_hash(data: Union[bytes, mmap.mmap]) -> str:
+    """Empreinte BLAKE2 du contenu (noms de fichiers, stockage partagé, IDs)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ImageBlob(ABC):
+    """Poignée sur le contenu d'une image (en mémoire ou sur disque)"""
+
+    size: int = 0
+    _hash: Optional[str] = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    @abstractmethod
+    def open(self) -> BinaryIO:
+        """Flux binaire en lecture sur le contenu"""
+
+    def read(self) -> bytes:
+        """Contenu complet (charge l'image en mémoire)"""
+        with self.open() as f:
+            return f.read()
+
+    @contextmanager
+    def view(self) -> Iterator[Union[bytes, mmap.mmap]]:
+        """Contenu accessible comme tampon (bytes ou mmap) le temps du bloc with"""
+        yield self.read()
+
+    def hash(self) -> str:
+        """Empreinte du contenu (content_hash), calculée une fois"""
+        if self._hash is None:
+            with self.view() as buffer:
+                self._hash = content_hash(buffer)
+        return self._hash
+
+    def copy_to(self, path: str):
+        """Écrit le contenu dans path"""
+        with self.open() as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, _COPY_BUFFER)
+
+
+class MemoryBlob(ImageBlob):
+    """Image gardée en mémoire (sous le seuil)"""
+
+    def __init__(self, data: bytes):
+        self.data = bytes(data)
+        self.size = len(self.data)
+
+    def open(self) -> BinaryIO:
+        return BytesIO(self.data)
+
+    def read(self) -> bytes:
+        return self.data
+
+    @contextmanager
+    def view(self) -> Iterator[bytes]:
+        yield self.data
+
+    def copy_to(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+class FileBlob(ImageBlob):
+    """Image déportée dans un fichier temporaire de l'ImageStore"""
+
+    def __init__(self, store: 'ImageStore', path: str, size: int):
+        # La référence au stockage le garde vivant (et ses fichiers) tant que la poignée existe
+        self.store = store
+        self.path = path
+        self.size = size
+
+    def open(self) -> BinaryIO:
+        return open(self.path, 'rb')
+
+    @contextmanager
+    def view(self) -> Iterator[Union[bytes, mmap.mmap]]:
+        if self.size == 0:
+            yield b''
+            return
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+    def copy_to(self, path: str):
+        shutil.copyfile(self.path, path)
+
+
+class ImageStore:
+    """Crée les ImageBlob d'une conversion : mémoire sous le seuil, disque au-delà"""
+
+    def __init__(self, threshold: Optional[int] = DEFAULT_SPILL_THRESHOLD, spill_dir: Optional[str] = None):
+        """
+        Args:
+            threshold: Taille (octets) à partir de laquelle une image est
+                déportée sur disque (0 : toujours ; None : jamais)
+            spill_dir: Dossier parent des fichiers temporaires (défaut : celui du système)
+        """
+        self.threshold = threshold
+        self.spill_dir = spill_dir
+        self._dir: Optional[str] = None
+        self._lock = threading.Lock()
+        self._finalizer = None
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+
+    def spills(self, size: int) -> bool:
+        return self.threshold is not None and size >= self.threshold
+
+    def _temp_path(self) -> str:
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="docx-images-", dir=self.spill_dir)
+                self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, True)
+            fd, path = tempfile.mkstemp(dir=self._dir, suffix=".bin")
+        os.close(fd)
+        return path
+
+    def add(self, data: bytes) -> ImageBlob:
+        """Poignée sur des octets déjà en mémoire"""
+        if not self.spills(len(data)):
+            self.memory_bytes += len(data)
+            return MemoryBlob(data)
+
+        path = self._temp_path()
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.spilled_bytes += len(data)
+        return FileBlob(self, path, len(data))
+
+    def add_stream(self, stream: BinaryIO, size: int) -> ImageBlob:
+        """
+        Poignée sur le contenu d'un flux de taille connue (membre de l'archive) :
+        au-delà du seuil, il est copié par blocs sans jamais être chargé en entier
+        """
+        if not self.spills(size):
+            return self.add(stream.read())
+
+        path = self._temp_path()
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, _COPY_BUFFER)
+        self.spilled_bytes += size
+        return FileBlob(self, path, size)
+
+    def close(self):
+        """Supprime les fichiers temporaires (les FileBlob deviennent illisibles)"""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+image_writer.py - Écriture concurrente des images
+
+Le parseur dépose les images dans une file bornée ; un pool de threads les
+écrit sur disque (ou dans le stockage partagé) et, si demandé, dans l'archive
+ZIP du paquet, pendant que la lecture du document continue. Quand la file est
+pleine, submit() bloque le parseur : la mémoire reste bornée.
+"""
+
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+from image_store import FileBlob, ImageBlob
+from media_store import MediaStore
+
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 16
+
+
+def _content_addressed(filename: str, digest: Optional[str]) -> bool:
+    return digest is not None and os.path.basename(filename).startswith(digest)
+
+
+class ImageWriter:
+    """File bornée d'écritures d'images servie par un pool de threads"""
+
+    def __init__(
+        self,
+        output_folder: str,
+        store: Optional[MediaStore] = None,
+        conversion_id: Optional[str] = None,
+        zip_file: Optional[zipfile.ZipFile] = None,
+        zip_prefix: str = "images/",
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING
+    ):
+        os.makedirs(output_folder, exist_ok=True)
+        self.output_folder = output_folder
+        self.location = os.path.abspath(output_folder)
+        self.store = store
+        self.conversion_id = conversion_id or self.location
+        self.zip_file = zip_file
+        self.zip_prefix = zip_prefix
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._zip_lock = threading.Lock()
+        self._submitted = set()
+        self.errors: List[BaseException] = []
+
+    def submit(self, data: Union[bytes, ImageBlob], filename: str, digest: Optional[str] = None):
+        """
+        Planifie l'écriture de `filename` (une seule fois par nom)
+        data : octets ou poignée image_store.ImageBlob (lue par le thread d'écriture)
+        digest : empreinte du contenu ; un fichier existant n'est conservé que
+            si son nom en dérive (nom adressé par contenu), sinon il est remplacé
+        Bloque tant que max_pending écritures sont en cours.
+        """
+        if filename in self._submitted:
+            return
+        self._submitted.add(filename)
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, data, filename, digest)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def _write(self, data: Union[bytes, ImageBlob], filename: str, digest: Optional[str]):
+        filepath = os.path.join(self.output_folder, filename)
+        if self.store is not None:
+            ext = filename.rsplit('.', 1)[-1]
+            _, blob_path = self.store.put(
+                data, ext, self.conversion_id,
+                location=self.location, digest=digest
+            )
+            MediaStore.materialize(blob_path, filepath)
+        # Nom dérivé de l'empreinte = même contenu : inutile de réécrire.
+        # Un nom séquentiel (image_001.png) peut désigner une autre image : toujours réécrit.
+        elif not (_content_addressed(filename, digest) and os.path.exists(filepath)):
+            # Écriture atomique : un fichier visible est toujours complet
+            tmp_path = f"{filepath}.{threading.get_ident()}.tmp"
+            if isinstance(data, ImageBlob):
+                data.copy_to(tmp_path)
+            else:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+            os.replace(tmp_path, filepath)
+
+        if self.zip_file is not None:
+            # Images déjà compressées : stockées sans recompression
+            arcname = self.zip_prefix + filename
+            with self._zip_lock:
+                if isinstance(data, FileBlob):
+                    self.zip_file.write(data.path, arcname, compress_type=zipfile.ZIP_STORED)
+                else:
+                    content = data.read() if isinstance(data, ImageBlob) else data
+                    self.zip_file.writestr(arcname, content, compress_type=zipfile.ZIP_STORED)
+
+    def close(self):
+        """Attend la fin des écritures ; relève la première erreur rencontrée"""
+        self._executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+incremental.py - Reconversion incrémentale
+
+Chaque conversion peut enregistrer un état (empreinte de contenu et widget de
+chaque bloc). À la reconversion, le flux de blocs est comparé à l'état
+précédent : les blocs inchangés reprennent leur widget (et donc leur ID
+Elementor), seuls les blocs modifiés sont reconstruits. Un patch compact
+décrit les changements à côté du JSON complet.
+"""
+
+import hashlib
+import json
+import os
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from element_ids import ElementIds, structure_seed
+from json_builder import build_elementor_json, build_widgets, column_display_width
+
+
+STATE_VERSION = 1
+
+
+def block_hash(
+    item: Dict[str, Any],
+    image_data: Dict[str, Any],
+    image_urls: Optional[Dict[str, str]] = None,
+    display_width: Optional[int] = None
+) -> str:
+    """
+    Empreinte du contenu d'un bloc (une image est identifiée par son contenu,
+    son URL et sa largeur d'affichage, pas son ref_id)
+    """
+    item_type = item.get('type')
+
+    if item_type == 'image':
+        img_info = image_data.get(item.get('ref_id'), {})
+        if 'hash' in img_info:
+            payload = img_info['hash']
+        elif 'blob' in img_info:
+            payload = img_info['blob'].hash()
+        else:
+            payload = item.get('ref_id', '')
+        url = (image_urls or {}).get(item.get('ref_id'), '')
+        payload = f"{payload}:{img_info.get('width')}x{img_info.get('height')}:{url}:{display_width}"
+    elif item_type == 'table':
+        payload = json.dumps(item.get('data', {}), sort_keys=True, ensure_ascii=False)
+    else:
+        payload = item.get('content', '')
+
+    return hashlib.blake2b(f"{item_type}\0{payload}".encode('utf-8'), digest_size=12).hexdigest()
+
+
+def load_state(path: str) -> Optional[Dict[str, Any]]:
+    """Charge l'état d'une conversion précédente (None si absent ou incompatible)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+def save_state(path: str, state: Dict[str, Any]):
+    """Enregistre l'état retourné par build_incremental"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+
+
+def _widget_ids(widgets: List[Optional[Dict[str, Any]]]) -> List[str]:
+    return [w['id'] for w in widgets if w is not None]
+
+
+def build_incremental(
+    structure: List[Dict[str, Any]],
+    image_data: Dict[str, Any],
+    image_urls: Dict[str, str],
+    previous_state: Optional[Dict[str, Any]],
+    num_columns: int = 1,
+    distribution_strategy: str = "auto"
+) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Construit le JSON Elementor en réutilisant les widgets des blocs inchangés
+
+    Returns:
+        tuple: (elementor_json, state, patch)
+        - state : à passer à save_state pour la prochaine reconversion
+          (graine des IDs, empreinte et widget de chaque bloc)
+        - patch : {'base_blocks', 'blocks', 'reused', 'rebuilt', 'ops': [...]}
+          avec des opérations 'replace', 'insert' et 'delete' sur les IDs de widgets
+    """
+    display_width = column_display_width(num_columns)
+    hashes = [block_hash(item, image_data, image_urls, display_width) for item in structure]
+    old_blocks = previous_state['blocks'] if previous_state else []
+    old_hashes = [block['hash'] for block in old_blocks]
+
+    matcher = SequenceMatcher(None, old_hashes, hashes, autojunk=False)
+    opcodes = matcher.get_opcodes()
+
+    reuse: List[Optional[Dict[str, Any]]] = [None] * len(structure)
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                reuse[j1 + offset] = old_blocks[i1 + offset]['widget']
+
+    # La graine de la première conversion est conservée : section et colonnes gardent leurs IDs
+    seed = previous_state.get('seed') if previous_state else None
+    ids = ElementIds(seed or structure_seed(structure, image_data))
+
+    widgets = build_widgets(structure, image_data, image_urls, reuse, ids=ids, display_width=display_width)
+
+    # Patch : changements exprimés en IDs de widgets
+    ops = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            continue
+        old_ids = _widget_ids([block['widget'] for block in old_blocks[i1:i2]])
+        new_widgets = [w for w in widgets[j1:j2] if w is not None]
+        if tag == 'delete':
+            ops.append({'op': 'delete', 'ids': old_ids})
+        elif tag == 'insert':
+            previous_ids = _widget_ids(widgets[:j1])
+            ops.append({
+                'op': 'insert',
+                'after': previous_ids[-1] if previous_ids else None,
+                'widgets': new_widgets
+            })
+        else:
+            ops.append({'op': 'replace', 'ids': old_ids, 'widgets': new_widgets})
+
+    reused = sum(1 for w in reuse if w is not None)
+    patch = {
+        'base_blocks': len(old_blocks),
+        'blocks': len(structure),
+        'reused': reused,
+        'rebuilt': len(structure) - reused,
+        'ops': ops,
+    }
+
+    elementor_json = build_elementor_json(
+        structure,
+        image_data,
+        image_urls,
+        num_columns=num_columns,
+        distribution_strategy=distribution_strategy,
+        widgets=widgets,
+        ids=ids
+    )
+
+    state = {
+        'version': STATE_VERSION,
+        'seed': ids.seed,
+        'blocks': [{'hash': h, 'widget': w} for h, w in zip(hashes, widgets)],
+    }
+
+    return elementor_json, state, patch
@@ -3,14 +3,50 @@
 json_builder.py - Construction JSON Elementor avec widgets corrects et support multi-colonnes
 """
 
-import random
-import string
 from typing import List, Dict, Any, Optional
 
+from element_ids import ElementIds, structure_seed
 
-def generate_id() -> str:
-    """Génère un ID unique pour Elementor"""
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=7))
+
+# Largeur de contenu d'une section Elementor par défaut (px)
+CONTAINER_WIDTH = 1140
+
+
+def generate_id(ids: ElementIds, path: str) -> str:
+    """Génère l'ID Elementor déterministe de l'élément situé à `path`"""
+    return ids.make(path)
+
+
+def column_display_width(num_columns: int) -> int:
+    """Largeur d'affichage d'un élément dans une colonne (px)"""
+    return -(-CONTAINER_WIDTH // num_columns)
+
+
+def select_image_variant(img_info: Dict[str, Any], display_width: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Variante WebP à référencer (voir image_pipeline) : la plus petite qui
+    couvre la largeur d'affichage, la plus grande à défaut
+    """
+    variants = sorted(
+        (v for v in img_info.get('variants', []) if v.get('format') == 'WEBP'),
+        key=lambda v: v['width']
+    )
+    if not variants:
+        return None
+    if display_width is not None:
+        for variant in variants:
+            if variant['width'] >= display_width:
+                return variant
+    return variants[-1]
+
+
+def image_srcset(img_info: Dict[str, Any], image_format: str = 'WEBP') -> str:
+    """Attribut srcset des variantes d'un format : "url 480w, url 768w, ..." """
+    variants = sorted(
+        (v for v in img_info.get('variants', []) if v.get('format') == image_format),
+        key=lambda v: v['width']
+    )
+    return ", ".join(f"{v['url']} {v['width']}w" for v in variants)
 
 
 def distribute_elements(elements: List[Dict[str, Any]], num_columns: int, strategy: str = "auto") -> List[List[Dict[str, Any]]]:
@@ -65,10 +101,10 @@ def distribute_elements(elements: List[Dict[str, Any]], num_columns: int, strate
     return distributed
 
 
-def create_heading_widget(content: str, level: str) -> Dict[str, Any]:
+def create_heading_widget(content: str, level: str, widget_id: str) -> Dict[str, Any]:
     """Crée un widget heading avec la structure correcte"""
     return {
-        "id": generate_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "title": content,
@@ -79,10 +115,10 @@ def create_heading_widget(content: str, level: str) -> Dict[str, Any]:
     }
 
 
-def create_text_widget(content: str) -> Dict[str, Any]:
+def create_text_widget(content: str, widget_id: str) -> Dict[str, Any]:
     """Crée un widget text-editor"""
     return {
-        "id": generate_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "editor": content
@@ -92,11 +128,33 @@ def create_text_widget(content: str) -> Dict[str, Any]:
     }
 
 
-def create_image_widget(ref_id: str, image_urls: Dict[str, str], image_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Crée un widget image avec URL et métadonnées"""
+def create_image_widget(
+    ref_id: str,
+    image_urls: Dict[str, str],
+    image_data: Dict[str, Any],
+    widget_id: str,
+    display_width: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Crée un widget image avec URL et métadonnées
+    Si l'image a des variantes responsives, référence celle adaptée à display_width
+    (bornée par la taille d'affichage de l'image dans le document) et liste
+    toutes les variantes : srcset/sizes (WebP) et sources (AVIF, si produit)
+    """
     image_url = image_urls.get(ref_id, "")
     img_info = image_data.get(ref_id, {})
     
+    # Une image affichée plus petite dans Word (wp:extent) n'a pas besoin de la largeur de colonne
+    if display_width is not None and img_info.get('display_width'):
+        display_width = min(display_width, img_info['display_width'])
+    
+    variant = select_image_variant(img_info, display_width)
+    srcset = image_srcset(img_info) if variant is not None else ""
+    avif_srcset = image_srcset(img_info, 'AVIF') if variant is not None else ""
+    if variant is not None:
+        image_url = variant['url']
+        img_info = variant
+    
     settings = {
         "image": {
             "url": image_url,
@@ -105,13 +163,20 @@ def create_image_widget(ref_id: str, image_urls: Dict[str, str], image_data: Dic
         "image_size": "full"
     }
     
+    if srcset:
+        settings["image"]["srcset"] = srcset
+        if display_width is not None:
+            settings["image"]["sizes"] = f"(max-width: {display_width}px) 100vw, {display_width}px"
+    if avif_srcset:
+        settings["image"]["sources"] = [{"type": "image/avif", "srcset": avif_srcset}]
+    
     # Ajouter dimensions si disponibles
     if 'width' in img_info and 'height' in img_info:
         settings["image"]["width"] = img_info['width']
         settings["image"]["height"] = img_info['height']
     
     return {
-        "id": generate_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": settings,
         "elements": [],
@@ -119,26 +184,44 @@ def create_image_widget(ref_id: str, image_urls: Dict[str, str], image_data: Dic
     }
 
 
-def create_table_widget(table_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Crée un widget tableau HTML Elementor"""
+def _span_attrs(cell: Dict[str, Any]) -> str:
+    """Attributs colspan/rowspan d'une cellule fusionnée"""
+    attrs = ''
+    if cell.get('colspan', 1) > 1:
+        attrs += f' colspan="{cell["colspan"]}"'
+    if cell.get('rowspan', 1) > 1:
+        attrs += f' rowspan="{cell["rowspan"]}"'
+    return attrs
+
+
+def create_table_widget(table_data: Dict[str, Any], widget_id: str) -> Dict[str, Any]:
+    """
+    Crée un widget tableau HTML Elementor
+    Utilise les cellules fusionnées (colspan/rowspan) si disponibles
+    """
     rows = table_data.get('rows', [])
     has_header = table_data.get('has_header', False)
     
+    # Cellules d'origine avec fusions ; à défaut, une cellule par case de la grille
+    cells = table_data.get('cells')
+    if cells is None:
+        cells = [[{'text': cell} for cell in row] for row in rows]
+    
     # Construire HTML du tableau
     html_parts = ['<table style="width:100%; border-collapse: collapse;">']
     
-    for idx, row in enumerate(rows):
+    for idx, row in enumerate(cells):
         if idx == 0 and has_header:
             # Ligne header
             html_parts.append('<thead><tr>')
             for cell in row:
-                html_parts.append(f'<th style="border:1px solid #ddd; padding:8px; background-color:#f2f2f2; font-weight:bold;">{cell}</th>')
+                html_parts.append(f'<th{_span_attrs(cell)} style="border:1px solid #ddd; padding:8px; background-color:#f2f2f2; font-weight:bold;">{cell["text"]}</th>')
             html_parts.append('</tr></thead><tbody>')
         else:
             # Lignes normales
             html_parts.append('<tr>')
             for cell in row:
-                html_parts.append(f'<td style="border:1px solid #ddd; padding:8px;">{cell}</td>')
+                html_parts.append(f'<td{_span_attrs(cell)} style="border:1px solid #ddd; padding:8px;">{cell["text"]}</td>')
             html_parts.append('</tr>')
     
     if has_header:
@@ -149,7 +232,7 @@ def create_table_widget(table_data: Dict[str, Any]) -> Dict[str, Any]:
     table_html = ''.join(html_parts)
     
     return {
-        "id": generate_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "editor": table_html
@@ -159,12 +242,80 @@ def create_table_widget(table_data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def create_widget(
+    item: Dict[str, Any],
+    image_urls: Dict[str, str],
+    image_data: Dict[str, Any],
+    widget_id: str,
+    display_width: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """Crée le widget correspondant à un élément de structure (None si type inconnu)"""
+    item_type = item.get('type')
+    
+    # Headings (h1-h6)
+    if item_type in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+        return create_heading_widget(item['content'], item_type, widget_id)
+    
+    # Paragraphes
+    elif item_type == 'p':
+        return create_text_widget(item['content'], widget_id)
+    
+    # Images
+    elif item_type == 'image':
+        ref_id = item.get('ref_id')
+        return create_image_widget(ref_id, image_urls, image_data, widget_id, display_width)
+    
+    # Tableaux
+    elif item_type == 'table':
+        return create_table_widget(item['data'], widget_id)
+    
+    return None
+
+
+def build_widgets(
+    structure: List[Dict[str, Any]],
+    image_data: Dict[str, Any],
+    image_urls: Dict[str, str],
+    reuse: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ids: Optional[ElementIds] = None,
+    display_width: Optional[int] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Crée un widget par élément de structure (même ordre)
+    
+    Args:
+        reuse: Widgets déjà construits à conserver tels quels, alignés sur
+            structure (None = à construire)
+        ids: Générateur d'IDs de la construction (par défaut, graine = contenu du document)
+        display_width: Largeur d'affichage des images (choix de la variante)
+    """
+    if ids is None:
+        ids = ElementIds(structure_seed(structure, image_data))
+    
+    # Les IDs conservés sont réservés avant d'en dériver de nouveaux
+    if reuse is not None:
+        for widget in reuse:
+            if widget is not None:
+                ids.reserve(widget['id'])
+    
+    widgets = []
+    for idx, item in enumerate(structure):
+        if reuse is not None and reuse[idx] is not None:
+            widgets.append(reuse[idx])
+        else:
+            widget_id = generate_id(ids, f"widget/{idx}")
+            widgets.append(create_widget(item, image_urls, image_data, widget_id, display_width))
+    return widgets
+
+
 def build_elementor_json(
     structure: List[Dict[str, Any]], 
     image_data: Dict[str, Any],
     image_urls: Dict[str, str],
     num_columns: int = 1,
-    distribution_strategy: str = "auto"
+    distribution_strategy: str = "auto",
+    widgets: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ids: Optional[ElementIds] = None
 ) -> Dict[str, Any]:
     """
     Construit le JSON Elementor final avec widgets corrects et support multi-colonnes
@@ -175,7 +326,26 @@ def build_elementor_json(
         image_urls: URLs des images
         num_columns: Nombre de colonnes (1, 2 ou 3)
         distribution_strategy: Stratégie de distribution
+        widgets: Widgets déjà construits, alignés sur structure (voir build_widgets)
+        ids: Générateur d'IDs (par défaut, graine = contenu du document :
+            des entrées identiques donnent un JSON identique)
     """
+    if ids is None:
+        ids = ElementIds(structure_seed(structure, image_data))
+    
+    if widgets is None:
+        widgets = build_widgets(
+            structure, image_data, image_urls,
+            ids=ids, display_width=column_display_width(num_columns)
+        )
+    else:
+        for widget in widgets:
+            if widget is not None:
+                ids.reserve(widget['id'])
+    
+    # Widget de chaque élément (les éléments distribués sont les mêmes objets)
+    widget_by_item = {id(item): widget for item, widget in zip(structure, widgets)}
+    
     # Distribuer les éléments entre colonnes
     distributed_elements = distribute_elements(structure, num_columns, distribution_strategy)
     
@@ -190,49 +360,28 @@ def build_elementor_json(
     # Créer les colonnes Elementor
     elementor_columns = []
     
-    for col_elements in distributed_elements:
-        widgets = []
-        
-        for item in col_elements:
-            item_type = item.get('type')
-            
-            # Headings (h1-h6)
-            if item_type in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                widget = create_heading_widget(item['content'], item_type)
-                widgets.append(widget)
-            
-            # Paragraphes
-            elif item_type == 'p':
-                widget = create_text_widget(item['content'])
-                widgets.append(widget)
-            
-            # Images
-            elif item_type == 'image':
-                ref_id = item.get('ref_id')
-                widget = create_image_widget(ref_id, image_urls, image_data)
-                widgets.append(widget)
-            
-            # Tableaux
-            elif item_type == 'table':
-                widget = create_table_widget(item['data'])
-                widgets.append(widget)
+    for col_idx, col_elements in enumerate(distributed_elements):
+        column_widgets = [
+            widget_by_item[id(item)] for item in col_elements
+            if widget_by_item[id(item)] is not None
+        ]
         
         # Créer la colonne
         column = {
-            "id": generate_id(),
+            "id": generate_id(ids, f"section/column/{col_idx}"),
             "elType": "column",
             "settings": {
                 "_column_size": column_width,
                 "_inline_size": None
             },
-            "elements": widgets
+            "elements": column_widgets
         }
         
         elementor_columns.append(column)
     
     # Structure Elementor complète
     section = {
-        "id": generate_id(),
+        "id": generate_id(ids, "section"),
         "elType": "section",
         "settings": {},
         "elements": elementor_columns
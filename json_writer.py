@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+json_writer.py - Écriture en flux du JSON Elementor
+
+Le document n'est jamais sérialisé en une seule chaîne : section, colonnes et
+widgets sont écrits un par un dans le fichier (ou tout flux binaire). Mode
+compact optionnel (sans indentation) ; orjson est utilisé s'il est installé,
+le module json standard sinon. La sortie indentée est identique à
+json.dumps(data, ensure_ascii=False, indent=2) (avec orjson, aux notations
+exponentielles des flottants près : 1e20 au lieu de 1e+20).
+"""
+
+import json
+import sys
+from typing import Any, BinaryIO
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Niveaux de conteneurs écrits en flux :
+# page → content → section → elements → colonne → elements → widget (sérialisé d'un bloc)
+STREAM_DEPTH = 6
+
+INDENT = b'  '
+
+
+def _dumps(value: Any, compact: bool) -> bytes:
+    """Sérialise une valeur d'un bloc (orjson si disponible)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value) if compact else orjson.dumps(value, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            # Valeur non supportée par orjson (entier hors 64 bits, clé non texte...)
+            pass
+    if compact:
+        text = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    else:
+        text = json.dumps(value, ensure_ascii=False, indent=2)
+    return text.encode('utf-8')
+
+
+def _write_value(value: Any, fp: BinaryIO, level: int, depth: int, compact: bool):
+    if depth <= 0 or not isinstance(value, (dict, list)) or not value:
+        data = _dumps(value, compact)
+        if not compact and level:
+            # Les chaînes JSON n'ont pas de retour à la ligne brut : ré-indentation sûre
+            data = data.replace(b'\n', b'\n' + INDENT * level)
+        fp.write(data)
+        return
+
+    if compact:
+        item_sep, key_sep, opening, closing = b',', b':', b'', b''
+    else:
+        item_sep, key_sep = b',', b': '
+        opening = b'\n' + INDENT * (level + 1)
+        closing = b'\n' + INDENT * level
+
+    if isinstance(value, dict):
+        fp.write(b'{')
+        for idx, (key, child) in enumerate(value.items()):
+            if idx:
+                fp.write(item_sep)
+            fp.write(opening)
+            fp.write(_dumps(str(key), True))
+            fp.write(key_sep)
+            _write_value(child, fp, level + 1, depth - 1, compact)
+        fp.write(closing + b'}')
+    else:
+        fp.write(b'[')
+        for idx, child in enumerate(value):
+            if idx:
+                fp.write(item_sep)
+            fp.write(opening)
+            _write_value(child, fp, level + 1, depth - 1, compact)
+        fp.write(closing + b']')
+
+
+def write_json(data: Any, fp: BinaryIO, compact: bool = False):
+    """Écrit le JSON Elementor dans un flux binaire (fichier, socket.makefile('wb'), ...)"""
+    _write_value(data, fp, 0, STREAM_DEPTH, compact)
+
+
+def save_json(data: Any, path: str, compact: bool = False):
+    """Écrit le JSON Elementor dans un fichier"""
+    with open(path, 'wb') as f:
+        write_json(data, f, compact)
+
+
+def print_json(data: Any, compact: bool = False):
+    """Écrit le JSON Elementor sur la sortie standard"""
+    write_json(data, sys.stdout.buffer, compact)
+    sys.stdout.buffer.write(b'\n')
+    sys.stdout.flush()
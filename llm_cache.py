@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+llm_cache.py - Cache persistant des réponses du modèle (Gemini)
+
+Clé = SHA-256 du nom du modèle, de la configuration de génération et du
+prompt : un prompt identique (document retéléversé, reprise après échec,
+sections communes à plusieurs documents) est servi sans appel à l'API.
+Les réponses sont stockées dans une base SQLite ; les entrées expirent
+après un TTL et les moins récemment utilisées sont évincées au-delà de la
+taille maximale. En lecture seule (CI), le cache est consulté sans jamais
+être modifié.
+
+Usage:
+    python llm_cache.py stats
+    python llm_cache.py evict --ttl-days 30 --max-mb 100
+    python llm_cache.py clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+
+DEFAULT_PATH = os.path.join("outputs", "llm_cache.sqlite3")
+DEFAULT_TTL = 30 * 24 * 3600  # 30 jours
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024  # 100 Mo
+
+# Incrémenter quand le format des prompts ou des réponses change
+CACHE_VERSION = 1
+
+
+class LLMCache:
+    """Réponses du modèle adressées par (modèle, configuration, prompt)"""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        ttl: Optional[float] = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        read_only: bool = False
+    ):
+        """
+        Args:
+            ttl: Durée de vie d'une réponse en secondes (None : illimitée)
+            read_only: Consulter sans écrire (ni nouvelles réponses, ni
+                date d'accès, ni éviction)
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+
+        if read_only:
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Une connexion par opération : utilisable depuis plusieurs threads/processus
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        else:
+            conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(model_name: str, generation_config: Optional[Dict[str, Any]], prompt: str) -> str:
+        """Clé : modèle + configuration (clés triées) + empreinte du prompt"""
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        payload = json.dumps(
+            {'v': CACHE_VERSION, 'model': model_name, 'config': generation_config or {}, 'prompt': prompt_hash},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Réponse en cache (None si absente ou expirée) ; rafraîchit la date d'accès"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self._expired(row[1], now):
+                    if not self.read_only:
+                        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is not None and not self.read_only:
+                    conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            # Cache illisible (absent en lecture seule, verrouillé...) : appel normal à l'API
+            print(f"⚠️  Cache LLM indisponible: {e}", file=sys.stderr)
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, response: str):
+        """Enregistre une réponse validée puis applique les limites du cache"""
+        if self.read_only:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, len(response.encode('utf-8')), now, now)
+                )
+        except sqlite3.Error as e:
+            # Cache verrouillé ou plein : la réponse reste utilisable, seulement non mise en cache
+            print(f"⚠️  Cache LLM indisponible: {e}", file=sys.stderr)
+            return
+        self.evict()
+
+    def evict(self) -> Tuple[int, int]:
+        """
+        Supprime les réponses expirées, puis les moins récemment utilisées
+        au-delà de max_bytes
+
+        Returns:
+            tuple: (nombre de réponses supprimées, octets libérés)
+        """
+        if self.read_only:
+            return 0, 0
+
+        removed, freed = 0, 0
+        try:
+            with self._connect() as conn:
+                if self.ttl is not None:
+                    cutoff = time.time() - self.ttl
+                    removed, freed = conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (cutoff,)
+                    ).fetchone()
+                    conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    victims = []
+                    for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                        if total <= self.max_bytes:
+                            break
+                        victims.append((key,))
+                        total -= size
+                        freed += size
+                    conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                    removed += len(victims)
+        except sqlite3.Error as e:
+            # Transaction annulée : rien n'a été supprimé
+            print(f"⚠️  Cache LLM indisponible: {e}", file=sys.stderr)
+            return 0, 0
+
+        return removed, freed
+
+    def clear(self) -> int:
+        """Vide le cache, retourne le nombre de réponses supprimées"""
+        if self.read_only:
+            return 0
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM responses")
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            count, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {'responses': count, 'bytes': size}
+
+
+def main():
+    """Commande de maintenance du cache"""
+    parser = argparse.ArgumentParser(description="Maintenance du cache des réponses du modèle")
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Base SQLite du cache')
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Affiche la taille du cache')
+
+    evict_parser = subparsers.add_parser('evict', help='Supprime les réponses expirées et au-delà du quota')
+    evict_parser.add_argument('--ttl-days', type=float, default=DEFAULT_TTL / 86400, help='Durée de vie en jours')
+    evict_parser.add_argument('--max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Taille maximale en Mo')
+
+    subparsers.add_parser('clear', help='Vide le cache')
+
+    args = parser.parse_args()
+
+    if args.command == 'evict':
+        cache = LLMCache(args.path, ttl=args.ttl_days * 86400, max_bytes=args.max_mb * 1024 * 1024)
+        removed, freed = cache.evict()
+        print(f"{removed} réponses supprimées, {freed / 1024:.1f} Ko libérés")
+        return 0
+
+    cache = LLMCache(args.path)
+    if args.command == 'stats':
+        stats = cache.stats()
+        print(f"{stats['responses']} réponses, {stats['bytes'] / 1024:.1f} Ko")
+    elif args.command == 'clear':
+        print(f"{cache.clear()} réponses supprimées")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+media_store.py - Stockage d'images persistant adressé par contenu
+
+Les images extraites sont conservées une seule fois par empreinte BLAKE2 dans
+un dossier partagé par toutes les conversions. Chaque conversion obtient ses
+fichiers par lien physique (ou copie si le lien est impossible) et un petit
+manifeste SQLite tient le compte des références. La commande `gc` supprime les
+images qu'aucune conversion vivante n'utilise.
+
+Usage:
+    python media_store.py stats
+    python media_store.py release <conversion_id>
+    python media_store.py gc
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple, Union
+
+from image_store import ImageBlob, content_hash
+
+
+DEFAULT_ROOT = os.path.join("outputs", "media_store")
+
+
+class MediaStore:
+    """Stockage d'images adressé par contenu, partagé entre conversions"""
+
+    def __init__(self, root: str = DEFAULT_ROOT):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.manifest_path = os.path.join(root, "manifest.sqlite3")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS refs (
+                    conversion_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    location TEXT,
+                    PRIMARY KEY (conversion_id, hash)
+                );
+                CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash);
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Une connexion par opération : utilisable depuis plusieurs threads/processus
+        conn = sqlite3.connect(self.manifest_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def blob_path(self, digest: str, ext: str) -> str:
+        """Chemin du blob dans le stockage (sous-dossier par préfixe d'empreinte)"""
+        return os.path.join(self.blobs_dir, digest[:2], f"{digest}.{ext}")
+
+    def put(
+        self,
+        data: Union[bytes, ImageBlob],
+        ext: str,
+        conversion_id: str,
+        location: Optional[str] = None,
+        digest: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """
+        Ajoute une image (écrite seulement si son contenu est inconnu) et
+        enregistre la référence de la conversion
+        data : octets ou poignée image_store.ImageBlob (copiée sans être chargée)
+
+        La référence est enregistrée avant de vérifier la présence du fichier :
+        un gc lancé ensuite ne peut plus le supprimer, et si un gc est passé
+        juste avant, le fichier manquant est simplement réécrit.
+
+        Returns:
+            tuple: (empreinte, chemin du blob)
+        """
+        if isinstance(data, ImageBlob):
+            digest = digest or data.hash()
+        else:
+            digest = digest or content_hash(data)
+        path = self.blob_path(digest, ext)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, ext, size, created_at) VALUES (?, ?, ?, ?)",
+                (digest, ext, len(data), time.time())
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO refs (conversion_id, hash, location) VALUES (?, ?, ?)",
+                (conversion_id, digest, location)
+            )
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Écriture atomique : un blob visible est toujours complet
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            if isinstance(data, ImageBlob):
+                os.close(fd)
+                data.copy_to(tmp_path)
+            else:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+            # mkstemp crée le fichier en 0600 : les liens des dossiers de sortie doivent rester lisibles
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+
+        return digest, path
+
+    @staticmethod
+    def materialize(blob_path: str, dest_path: str) -> str:
+        """
+        Expose un blob à dest_path par lien physique (copie en repli)
+        Un fichier existant n'est conservé que s'il est déjà un lien vers le
+        blob ; sinon (ancienne image sous le même nom) il est remplacé de
+        façon atomique.
+        """
+        try:
+            if os.path.samefile(blob_path, dest_path):
+                return dest_path
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+        return dest_path
+
+    def refcount(self, digest: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM refs WHERE hash = ?", (digest,)).fetchone()
+        return row[0]
+
+    def release(self, conversion_id: str) -> int:
+        """Supprime les références d'une conversion, retourne leur nombre"""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM refs WHERE conversion_id = ?", (conversion_id,))
+        return cursor.rowcount
+
+    def gc(self, prune_missing: bool = True) -> Tuple[int, int]:
+        """
+        Supprime les blobs sans référence
+
+        Le manifeste est verrouillé en écriture pendant toute l'opération :
+        aucune référence ne peut être ajoutée entre la recherche des blobs
+        orphelins et leur suppression.
+
+        Args:
+            prune_missing: Libérer d'abord les références dont le dossier
+                de sortie (location) n'existe plus
+
+        Returns:
+            tuple: (nombre de blobs supprimés, octets libérés)
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if prune_missing:
+                stale = [
+                    (conversion_id, digest)
+                    for conversion_id, digest, location in conn.execute(
+                        "SELECT conversion_id, hash, location FROM refs WHERE location IS NOT NULL"
+                    )
+                    if not os.path.exists(location)
+                ]
+                conn.executemany("DELETE FROM refs WHERE conversion_id = ? AND hash = ?", stale)
+
+            orphans = conn.execute(
+                "SELECT hash, ext, size FROM blobs WHERE hash NOT IN (SELECT hash FROM refs)"
+            ).fetchall()
+
+            removed, freed = 0, 0
+            for digest, ext, size in orphans:
+                try:
+                    os.remove(self.blob_path(digest, ext))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                removed += 1
+                freed += size
+
+        return removed, freed
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            refs, conversions = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT conversion_id) FROM refs"
+            ).fetchone()
+        return {'blobs': blobs, 'bytes': size, 'references': refs, 'conversions': conversions}
+
+
+def main():
+    """Commande de maintenance du stockage"""
+    parser = argparse.ArgumentParser(description="Maintenance du stockage d'images partagé")
+    parser.add_argument('--root', default=DEFAULT_ROOT, help='Dossier du stockage')
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Affiche la taille du stockage')
+
+    release_parser = subparsers.add_parser('release', help="Libère les références d'une conversion")
+    release_parser.add_argument('conversion_id')
+
+    gc_parser = subparsers.add_parser('gc', help='Supprime les images non référencées')
+    gc_parser.add_argument(
+        '--keep-missing',
+        action='store_true',
+        help='Conserver les références dont le dossier de sortie a disparu'
+    )
+
+    args = parser.parse_args()
+    store = MediaStore(args.root)
+
+    if args.command == 'stats':
+        stats = store.stats()
+        print(f"{stats['blobs']} images uniques, {stats['bytes'] / 1024 / 1024:.1f} Mo, "
+              f"{stats['references']} références ({stats['conversions']} conversions)")
+    elif args.command == 'release':
+        count = store.release(args.conversion_id)
+        print(f"{count} références libérées")
+    elif args.command == 'gc':
+        removed, freed = store.gc(prune_missing=not args.keep_missing)
+        print(f"{removed} images supprimées, {freed / 1024 / 1024:.1f} Mo libérés")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
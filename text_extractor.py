@@ -5,82 +5,73 @@ Extraction texte direct DOCX/PDF sans IA - fiabilité 99%
 VERSION CORRIGÉE - Conserve la position des images
 """
 
-from typing import List, Dict, Any
-from docx import Document
-from docx.oxml.text.paragraph import CT_P
-from docx.text.paragraph import Paragraph
+from typing import List, Dict, Any, Union, BinaryIO
 
+import docx_engine
 
-def extract_text_from_docx(docx_path: str) -> List[Dict[str, Any]]:
+
+def extract_text_from_docx(docx_path: docx_engine.DocxSource) -> List[Dict[str, Any]]:
     """
     Extraction directe texte DOCX sans IA
     Détecte hiérarchie H1-H6 par styles Word
     VERSION CORRIGÉE - Conserve l'ordre exact des éléments
+    Accepte un chemin, des octets, un flux binaire ou un docx_engine.ParsedDocument déjà lu
     """
-    doc = Document(docx_path)
     structure = []
     image_counter = 1
     
-    for element in doc.element.body:
-        if isinstance(element, CT_P):
-            para = Paragraph(element, doc)
-            
-            # Vérifier s'il y a une image dans ce paragraphe
-            has_image = False
-            if para._element.xpath('.//pic:pic'):
-                # Ajouter l'image à sa position exacte
-                structure.append({
-                    'type': 'image',
-                    'ref_id': f"__IMAGE_{image_counter}__"
-                })
-                image_counter += 1
-                has_image = True
-            
-            # Traiter le texte SEULEMENT s'il n'y a pas d'image dans ce paragraphe
-            # ou si on veut garder le texte qui accompagne l'image (comportement configurable)
-            text = para.text.strip()
+    for record in docx_engine.iter_elements(docx_path, with_images=False):
+        if record['kind'] != 'paragraph':
+            continue
+        
+        # Vérifier s'il y a une image dans ce paragraphe
+        has_image = False
+        if record['has_picture']:
+            # Ajouter l'image à sa position exacte
+            structure.append({
+                'type': 'image',
+                'ref_id': f"__IMAGE_{image_counter}__"
+            })
+            image_counter += 1
+            has_image = True
+        
+        # Traiter le texte SEULEMENT s'il n'y a pas d'image dans ce paragraphe
+        # ou si on veut garder le texte qui accompagne l'image (comportement configurable)
+        text = record['text'].strip()
+        
+        # Si le paragraphe contient une image ET du texte, on ignore le texte
+        # (comportement par défaut pour correspondre à parse_document)
+        if text and not has_image:
+            # Déterminer le type d'élément basé sur le style
+            level = record['heading_level']
+            elem_type = f'h{level}' if level else 'p'
             
-            # Si le paragraphe contient une image ET du texte, on ignore le texte
-            # (comportement par défaut pour correspondre à parse_document)
-            if text and not has_image:
-                style = para.style.name if para.style else 'Normal'
-                
-                # Déterminer le type d'élément basé sur le style
-                if 'Heading 1' in style or 'Title' in style:
-                    elem_type = 'h1'
-                elif 'Heading 2' in style:
-                    elem_type = 'h2'
-                elif 'Heading 3' in style:
-                    elem_type = 'h3'
-                elif 'Heading 4' in style:
-                    elem_type = 'h4'
-                elif 'Heading 5' in style:
-                    elem_type = 'h5'
-                elif 'Heading 6' in style:
-                    elem_type = 'h6'
-                else:
-                    elem_type = 'p'
-                
-                structure.append({
-                    'type': elem_type,
-                    'content': text  # CONTENU COMPLET sans troncation
-                })
+            structure.append({
+                'type': elem_type,
+                'content': text  # CONTENU COMPLET sans troncation
+            })
     
     return structure
 
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
+def extract_text_from_pdf(pdf_path: Union[str, bytes, bytearray, memoryview, BinaryIO]) -> List[Dict[str, Any]]:
     """
     Extraction directe texte PDF sans IA
     Détecte hiérarchie par taille police
     VERSION CORRIGÉE - Conserve l'ordre des éléments
+    Accepte un chemin, des octets ou un flux binaire
     """
     try:
         import fitz  # PyMuPDF
     except ImportError:
         raise ImportError("PyMuPDF requis: pip install pymupdf")
     
-    doc = fitz.open(pdf_path)
+    if isinstance(pdf_path, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=pdf_path, filetype="pdf")
+    elif hasattr(pdf_path, 'read'):
+        doc = fitz.open(stream=pdf_path.read(), filetype="pdf")
+    else:
+        doc = fitz.open(pdf_path)
     structure = []
     image_counter = 1
     
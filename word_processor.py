@@ -4,36 +4,38 @@ word_processor.py - Extraction optimisée avec détection heuristique
 """
 
 import re
-from typing import List, Dict, Any, Tuple
-from io import BytesIO
-from PIL import Image
-from docx import Document
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
-from docx.text.paragraph import Paragraph
+import zipfile
+from typing import List, Dict, Any, Tuple, Iterator, Optional
 from docx.table import Table
 
+import docx_engine
+import image_pipeline
+from image_writer import ImageWriter
+from image_store import ImageStore
+from media_store import MediaStore
 
-def detect_heading_level(text: str, style_name: str) -> str:
+
+# Niveau de style non résolu : detect_heading_level le déduit du nom du style
+_UNRESOLVED = object()
+
+
+def detect_heading_level(text: str, style_name: str, style_level: Any = _UNRESOLVED) -> str:
     """
     Détection heuristique du niveau de titre
     Utilise patterns numériques, longueur et style Word
+    
+    Args:
+        style_level: Niveau déjà résolu depuis styles.xml (héritage basedOn,
+            outlineLvl) ; None si le style n'est pas un titre. Omis, il est
+            déduit du nom du style.
     """
     text = text.strip()
     
     # 1. Vérifier d'abord les styles Word (si présents)
-    if 'Heading 1' in style_name or 'Title' in style_name:
-        return 'h1'
-    elif 'Heading 2' in style_name:
-        return 'h2'
-    elif 'Heading 3' in style_name:
-        return 'h3'
-    elif 'Heading 4' in style_name:
-        return 'h4'
-    elif 'Heading 5' in style_name:
-        return 'h5'
-    elif 'Heading 6' in style_name:
-        return 'h6'
+    if style_level is _UNRESOLVED:
+        style_level = docx_engine.style_heading_level(style_name)
+    if style_level:
+        return f'h{style_level}'
     
     # 2. Détection par pattern numéroté (2.1, 2.2.1, etc.)
     # Pattern: "2.1 Titre" ou "2.1.1 Sous-titre"
@@ -61,15 +63,15 @@ def extract_table_data(table: Table) -> Dict[str, Any]:
     """
     Extrait les données d'un tableau Word
     Retourne structure compatible Elementor
+    Parcourt directement w:tr/w:tc (fusions gridSpan/vMerge incluses)
     """
-    rows_data = []
-    
-    for row in table.rows:
-        cells_data = []
-        for cell in row.cells:
-            cell_text = cell.text.strip()
-            cells_data.append(cell_text)
-        rows_data.append(cells_data)
+    table_xml = docx_engine.read_table(table._tbl)
+    return _table_data_from_rows(table_xml['rows'], table_xml['cells'])
+
+
+def _table_data_from_rows(rows: List[List[str]], cells: Optional[List[List[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """Construit la structure tableau (avec détection du header) depuis la grille de textes"""
+    rows_data = [[cell.strip() for cell in row] for row in rows]
     
     # Détecter si première ligne est un header
     has_header = False
@@ -79,101 +81,112 @@ def extract_table_data(table: Table) -> Dict[str, Any]:
         second_row_avg = sum(len(cell) for cell in rows_data[1]) / len(rows_data[1]) if rows_data[1] else 0
         has_header = first_row_avg > 0 and first_row_avg < second_row_avg * 1.5
     
-    return {
+    table_data = {
         'rows': rows_data,
         'num_rows': len(rows_data),
         'num_cols': len(rows_data[0]) if rows_data else 0,
         'has_header': has_header
     }
+    
+    # Cellules fusionnées (colspan/rowspan) pour le rendu HTML
+    if cells is not None:
+        table_data['cells'] = [
+            [{**cell, 'text': cell['text'].strip()} for cell in row]
+            for row in cells
+        ]
+    
+    return table_data
 
 
-def extract_document_structure(docx_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+def iter_document_structure(
+    docx_path: docx_engine.DocxSource,
+    image_store: Optional[ImageStore] = None
+) -> Iterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """
+    Mode flux : lit word/document.xml directement depuis l'archive (lxml iterparse)
+    et produit les éléments un par un, dans l'ordre du document.
+    Chaque sous-arbre XML est libéré après lecture : mémoire constante.
+    
+    Yields:
+        (element, image_info) - image_info est None sauf pour les éléments 'image' ;
+        son contenu est une poignée image_info['blob'] (image_store.ImageBlob)
+    """
+    used_rel_ids = set()
+    image_counter = 1
+    position = 0
+    
+    for record in docx_engine.iter_elements(docx_path, image_store):
+        if record['kind'] == 'table':
+            yield {'type': 'table', 'data': _table_data_from_rows(record['rows'], record['cells'])}, None
+            position += 1
+            continue
+        
+        # Vérifier présence d'image (une seule image retenue par paragraphe)
+        has_image = False
+        if record['has_picture']:
+            for image in record['images']:
+                if image['rel_id'] in used_rel_ids:
+                    continue
+                
+                image_ref_id = f"__IMAGE_{image_counter}__"
+                image_info = {
+                    'blob': image['blob'],
+                    'format': image['format'],
+                    'width': image['width'],
+                    'height': image['height'],
+                    'position': position
+                }
+                if 'display_width' in image:
+                    image_info['display_width'] = image['display_width']
+                    image_info['display_height'] = image['display_height']
+                
+                yield {'type': 'image', 'ref_id': image_ref_id}, image_info
+                position += 1
+                
+                image_counter += 1
+                has_image = True
+                used_rel_ids.add(image['rel_id'])
+                break
+        
+        # Traiter le texte (seulement si pas d'image dans ce paragraphe)
+        if not has_image:
+            text = record['text'].strip()
+            if text:
+                style_name = record['style']
+                # Niveau résolu par le moteur (None : pas un titre, le nom du style n'est pas relu)
+                elem_type = detect_heading_level(text, style_name, record['heading_level'])
+                
+                yield {
+                    'type': elem_type,
+                    'content': text,
+                    'style': style_name
+                }, None
+                position += 1
+
+
+def extract_document_structure(
+    docx_path: docx_engine.DocxSource,
+    image_store: Optional[ImageStore] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
     """
     Extrait la structure complète du document avec détection intelligente
     Retourne (structure, image_data)
+    
+    Accepte un chemin, des octets (bytes, memoryview), un flux binaire
+    ou un docx_engine.ParsedDocument déjà lu.
+    Pour traiter les éléments au fil de la lecture, voir iter_document_structure.
+    
+    Les images de image_data ne sont pas des octets mais des poignées
+    (image_info['blob']) : au-delà du seuil de image_store, leur contenu
+    reste dans un fichier temporaire jusqu'à son écriture.
     """
-    doc = Document(docx_path)
     structure = []
     image_data = {}
-    image_counter = 1
     
-    # Créer mapping des relations d'images
-    image_rels = {}
-    for rel_id, rel in doc.part.rels.items():
-        if "image" in rel.target_ref:
-            image_rels[rel_id] = rel
-    
-    # Parcourir le document dans l'ordre exact
-    for element in doc.element.body:
-        # Traiter les tableaux
-        if isinstance(element, CT_Tbl):
-            table = Table(element, doc)
-            table_data = extract_table_data(table)
-            
-            structure.append({
-                'type': 'table',
-                'data': table_data
-            })
-        
-        # Traiter les paragraphes
-        elif isinstance(element, CT_P):
-            para = Paragraph(element, doc)
-            
-            # Vérifier présence d'image
-            has_image = False
-            if para._element.xpath('.//pic:pic'):
-                # Extraire l'image
-                para_xml = para._element.xml
-                for match_pattern in ['r:embed="', 'r:link="']:
-                    if match_pattern in para_xml:
-                        start = para_xml.find(match_pattern) + len(match_pattern)
-                        end = para_xml.find('"', start)
-                        if start > len(match_pattern) - 1 and end > start:
-                            rel_id = para_xml[start:end]
-                            
-                            if rel_id in image_rels:
-                                rel = image_rels[rel_id]
-                                image_ref_id = f"__IMAGE_{image_counter}__"
-                                
-                                try:
-                                    image_bytes = rel.target_part.blob
-                                    img = Image.open(BytesIO(image_bytes))
-                                    
-                                    image_data[image_ref_id] = {
-                                        'data': image_bytes,
-                                        'format': img.format or "PNG",
-                                        'width': img.width,
-                                        'height': img.height,
-                                        'position': len(structure)
-                                    }
-                                    
-                                    structure.append({
-                                        'type': 'image',
-                                        'ref_id': image_ref_id
-                                    })
-                                    
-                                    image_counter += 1
-                                    has_image = True
-                                    del image_rels[rel_id]
-                                    break
-                                except Exception as e:
-                                    print(f"Erreur extraction image: {e}")
-                        
-                        if has_image:
-                            break
-            
-            # Traiter le texte (seulement si pas d'image dans ce paragraphe)
-            if not has_image:
-                text = para.text.strip()
-                if text:
-                    style_name = para.style.name if para.style else 'Normal'
-                    elem_type = detect_heading_level(text, style_name)
-                    
-                    structure.append({
-                        'type': elem_type,
-                        'content': text,
-                        'style': style_name
-                    })
+    for element, image_info in iter_document_structure(docx_path, image_store):
+        if image_info is not None:
+            image_data[element['ref_id']] = image_info
+        structure.append(element)
     
     if not structure:
         raise ValueError("Document vide")
@@ -181,32 +194,134 @@ def extract_document_structure(docx_path: str) -> Tuple[List[Dict[str, Any]], Di
     return structure, image_data
 
 
-def save_images(image_data: Dict[str, Any], output_folder: str, base_url: str = "") -> Dict[str, str]:
+def _image_url(filename: str, base_url: str) -> str:
+    if base_url:
+        return f"{base_url.rstrip('/')}/{filename}"
+    return filename
+
+
+def image_filename(img_info: Dict[str, Any]) -> str:
+    """Nom de fichier d'après l'empreinte du contenu (renseigne img_info['hash'])"""
+    if 'hash' not in img_info:
+        img_info['hash'] = img_info['blob'].hash()
+    ext = img_info.get('format', 'PNG').lower()
+    if ext == 'jpeg':
+        ext = 'jpg'
+    return f"{img_info['hash']}.{ext}"
+
+
+def save_images(
+    image_data: Dict[str, Any],
+    output_folder: str,
+    base_url: str = "",
+    store: Optional[MediaStore] = None,
+    conversion_id: Optional[str] = None,
+    image_options: Optional[Dict[str, Any]] = None,
+    zip_file: Optional[zipfile.ZipFile] = None
+) -> Dict[str, str]:
     """
     Sauvegarde les images et retourne les URLs
-    """
-    import os
-    from datetime import datetime
     
-    os.makedirs(output_folder, exist_ok=True)
+    Les fichiers sont nommés d'après l'empreinte de leur contenu : une image
+    répétée n'est écrite qu'une fois et toutes ses occurrences pointent vers
+    la même URL (noms immuables, sans collision entre conversions).
+    Les écritures sont faites en parallèle (image_writer.ImageWriter).
+    
+    Args:
+        store: Stockage partagé entre conversions (media_store.MediaStore) ;
+            les fichiers sont alors des liens vers les blobs du stockage
+        conversion_id: Identifiant de la conversion pour le comptage des
+            références (par défaut le dossier de sortie)
+        image_options: Active le pipeline d'images responsives
+            (voir image_pipeline.default_options) : chaque image est plafonnée,
+            transcodée en WebP/AVIF et déclinée en plusieurs largeurs. L'URL
+            retournée est celle de la plus grande variante WebP et
+            img_info['variants'] liste toutes les variantes.
+        zip_file: Archive du paquet, alimentée en même temps que le disque
+    """
     image_urls = {}
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    written = {}
     
-    for idx, (ref_id, img_info) in enumerate(image_data.items(), 1):
-        if 'data' in img_info:
-            ext = img_info.get('format', 'PNG').lower()
-            if ext == 'jpeg':
-                ext = 'jpg'
-            
-            filename = f"{timestamp}_{idx:03d}.{ext}"
-            filepath = os.path.join(output_folder, filename)
+    for img_info in image_data.values():
+        if 'blob' in img_info:
+            img_info['hash'] = img_info['blob'].hash()
+    
+    # Variantes responsives, encodées en parallèle (une fois par contenu distinct)
+    variants_by_hash = {}
+    if image_options is not None:
+        jobs = {
+            img_info['hash']: img_info for img_info in image_data.values()
+            if 'blob' in img_info and image_pipeline.can_transcode(img_info)
+        }
+        # Avec un stockage ou une archive, toutes les variantes doivent être produites
+        reuse_folder = output_folder if store is None and zip_file is None else None
+        variants_by_hash = image_pipeline.process_images(jobs, image_options, reuse_folder)
+    
+    with ImageWriter(output_folder, store, conversion_id, zip_file) as writer:
+        for ref_id, img_info in image_data.items():
+            if 'blob' not in img_info:
+                continue
+            digest = img_info['hash']
             
-            with open(filepath, 'wb') as f:
-                f.write(img_info['data'])
+            variants = variants_by_hash.get(digest)
+            if variants is not None:
+                if digest not in written:
+                    for variant in variants:
+                        if 'data' in variant:
+                            writer.submit(variant.pop('data'), variant['file'])
+                    written[digest] = max(
+                        (v for v in variants if v['format'] == 'WEBP'), key=lambda v: v['width']
+                    )['file']
+                img_info['variants'] = [dict(variant, url=_image_url(variant['file'], base_url)) for variant in variants]
+            elif digest not in written:
+                written[digest] = image_filename(img_info)
+                writer.submit(img_info['blob'], written[digest], digest)
             
-            if base_url:
-                image_urls[ref_id] = f"{base_url.rstrip('/')}/{filename}"
-            else:
-                image_urls[ref_id] = filename
+            image_urls[ref_id] = _image_url(written[digest], base_url)
     
     return image_urls
+
+
+def extract_and_save(
+    docx_path: docx_engine.DocxSource,
+    output_folder: str,
+    base_url: str = "",
+    store: Optional[MediaStore] = None,
+    conversion_id: Optional[str] = None,
+    image_options: Optional[Dict[str, Any]] = None,
+    zip_file: Optional[zipfile.ZipFile] = None,
+    image_store: Optional[ImageStore] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Dict[str, str]]:
+    """
+    extract_document_structure + save_images, l'écriture des images
+    chevauchant la lecture du document : chaque image est déposée dans la
+    file bornée de l'ImageWriter dès qu'elle est lue.
+    
+    Avec image_options, le pipeline responsive a besoin de toutes les images :
+    extraction puis sauvegarde, comme avant.
+    
+    Returns:
+        tuple: (structure, image_data, image_urls)
+    """
+    if image_options is not None:
+        structure, image_data = extract_document_structure(docx_path, image_store)
+        image_urls = save_images(image_data, output_folder, base_url, store, conversion_id, image_options, zip_file)
+        return structure, image_data, image_urls
+    
+    structure = []
+    image_data = {}
+    image_urls = {}
+    
+    with ImageWriter(output_folder, store, conversion_id, zip_file) as writer:
+        for element, image_info in iter_document_structure(docx_path, image_store):
+            if image_info is not None:
+                filename = image_filename(image_info)
+                writer.submit(image_info['blob'], filename, image_info['hash'])
+                image_data[element['ref_id']] = image_info
+                image_urls[element['ref_id']] = _image_url(filename, base_url)
+            structure.append(element)
+    
+    if not structure:
+        raise ValueError("Document vide")
+    
+    return structure, image_data, image_urls
@@ -13,19 +13,20 @@ import json
 import os
 import sys
 import re
-from typing import List, Dict, Any, Optional
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from pathlib import Path
-from io import BytesIO
-import base64
 
 from dotenv import load_dotenv
 import google.generativeai as genai
-from docx import Document
-from docx.oxml.table import CT_Tbl
-from docx.oxml.text.paragraph import CT_P
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
-from PIL import Image
+
+import docx_engine
+from element_ids import ElementIds, structure_seed
+from json_writer import save_json, print_json
+from heading_detector import HeadingDetector
+import llm_cache
 
 
 # ============================================================================
@@ -181,20 +182,21 @@ def load_api_key() -> str:
     return api_key
 
 
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+
 def configure_gemini(api_key: str) -> genai.GenerativeModel:
     """Configure l'API Google Gemini"""
     genai.configure(api_key=api_key)
     
-    generation_config = {
-        "temperature": 0.1,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-    }
-    
     model = genai.GenerativeModel(
         model_name='gemini-2.5-pro',
-        generation_config=generation_config
+        generation_config=GENERATION_CONFIG
     )
     
     return model
@@ -204,35 +206,16 @@ def configure_gemini(api_key: str) -> genai.GenerativeModel:
 # PARSING DU DOCUMENT - CORRIGÉ
 # ============================================================================
 
-def extract_image_data(image_part) -> Dict[str, Any]:
-    """Extrait les données d'une image"""
-    try:
-        image_bytes = image_part.blob
-        image = Image.open(BytesIO(image_bytes))
-        
-        buffered = BytesIO()
-        image.save(buffered, format=image.format or "PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        return {
-            'data': image_bytes,
-            'base64': img_base64,
-            'format': image.format or "PNG",
-            'width': image.width,
-            'height': image.height
-        }
-    except Exception as e:
-        print(f"Erreur lors de l'extraction de l'image: {e}", file=sys.stderr)
-        return None
-
-
-def parse_document(docx_path: str) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
-    """Parse le document .docx - VERSION CORRIGÉE"""
-    if not os.path.exists(docx_path):
+def parse_document(docx_path: docx_engine.DocxSource) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Parse le document .docx - adaptateur sur docx_engine (un seul passage)
+    Accepte un chemin, des octets, un flux binaire ou un docx_engine.ParsedDocument
+    """
+    if isinstance(docx_path, (str, os.PathLike)) and not os.path.exists(docx_path):
         raise FileNotFoundError(f"Le fichier '{docx_path}' n'existe pas")
     
     try:
-        doc = Document(docx_path)
+        records = list(docx_engine.iter_elements(docx_path))
     except Exception as e:
         raise Exception(f"Impossible de lire le fichier .docx: {e}")
     
@@ -240,87 +223,44 @@ def parse_document(docx_path: str) -> tuple[List[Dict[str, Any]], Dict[str, Any]
     image_data = {}
     image_counter = 1
     
-    for element in doc.element.body:
-        if isinstance(element, CT_P):
-            paragraph = Paragraph(element, doc)
+    for record in records:
+        if record['kind'] != 'paragraph':
+            continue
+        
+        # Vérifier d'abord s'il y a une image dans ce paragraphe
+        has_image = False
+        if record['has_picture']:
+            for image in record['images']:
+                image_ref_id = f"__IMAGE_{image_counter}__"
+                # Format et dimensions déjà lus dans l'en-tête par le moteur
+                img_data = {key: value for key, value in image.items() if key != 'rel_id'}
+                
+                if img_data:
+                    image_data[image_ref_id] = img_data
+                    raw_structure.append({
+                        'type': 'image',
+                        'ref_id': image_ref_id
+                    })
+                    image_counter += 1
+                    has_image = True
+                    break
+        
+        # Traiter le texte seulement s'il n'y a pas d'image ou s'il y a du texte en plus
+        text = record['text'].strip()
+        if text and not has_image:  # Ne pas ajouter le texte si c'est un paragraphe avec image
+            style_name = record['style']
             
-            # CORRECTION : Vérifier d'abord s'il y a une image dans ce paragraphe
-            has_image = False
-            if paragraph._element.xpath('.//pic:pic'):
-                # Parcourir les runs pour trouver l'image
-                for run in paragraph.runs:
-                    if 'graphic' in run._element.xml:
-                        # Extraire le rId de l'image depuis le XML
-                        import xml.etree.ElementTree as ET
-                        try:
-                            # Parser le XML du run pour trouver le rId
-                            root = ET.fromstring(run._element.xml)
-                            # Chercher l'attribut r:embed ou r:link
-                            for elem in root.iter():
-                                for attr_name, attr_value in elem.attrib.items():
-                                    if 'embed' in attr_name or 'link' in attr_name:
-                                        # Trouver la relation correspondante
-                                        if attr_value in doc.part.rels:
-                                            rel = doc.part.rels[attr_value]
-                                            if "image" in rel.target_ref:
-                                                image_ref_id = f"__IMAGE_{image_counter}__"
-                                                img_data = extract_image_data(rel.target_part)
-                                                
-                                                if img_data:
-                                                    image_data[image_ref_id] = img_data
-                                                    raw_structure.append({
-                                                        'type': 'image',
-                                                        'ref_id': image_ref_id
-                                                    })
-                                                    image_counter += 1
-                                                    has_image = True
-                                                    break
-                                if has_image:
-                                    break
-                        except:
-                            # Fallback : méthode alternative si le parsing XML échoue
-                            # Extraire toutes les images de ce paragraphe
-                            for rel_id, rel in doc.part.rels.items():
-                                if "image" in rel.target_ref:
-                                    # Vérifier si cette image est référencée dans ce paragraphe
-                                    if rel_id in run._element.xml:
-                                        image_ref_id = f"__IMAGE_{image_counter}__"
-                                        img_data = extract_image_data(rel.target_part)
-                                        
-                                        if img_data:
-                                            image_data[image_ref_id] = img_data
-                                            raw_structure.append({
-                                                'type': 'image',
-                                                'ref_id': image_ref_id
-                                            })
-                                            image_counter += 1
-                                            has_image = True
-                                            break
-                        
-                        if has_image:
-                            break
+            level = record['heading_level']
+            if level and level <= 4:
+                elem_type = f'style_h{level}'
+            else:
+                elem_type = 'paragraph'
             
-            # Traiter le texte seulement s'il n'y a pas d'image ou s'il y a du texte en plus
-            text = paragraph.text.strip()
-            if text and not has_image:  # Ne pas ajouter le texte si c'est un paragraphe avec image
-                style_name = paragraph.style.name if paragraph.style else 'Normal'
-                
-                if 'Heading 1' in style_name or 'Title' in style_name:
-                    elem_type = 'style_h1'
-                elif 'Heading 2' in style_name:
-                    elem_type = 'style_h2'
-                elif 'Heading 3' in style_name:
-                    elem_type = 'style_h3'
-                elif 'Heading 4' in style_name:
-                    elem_type = 'style_h4'
-                else:
-                    elem_type = 'paragraph'
-                
-                raw_structure.append({
-                    'type': elem_type,
-                    'content': text,
-                    'original_style': style_name
-                })
+            raw_structure.append({
+                'type': elem_type,
+                'content': text,
+                'original_style': style_name
+            })
     
     if not raw_structure:
         raise ValueError("Le document ne contient aucun contenu exploitable")
@@ -332,45 +272,294 @@ def parse_document(docx_path: str) -> tuple[List[Dict[str, Any]], Dict[str, Any]
 # ANALYSE SÉMANTIQUE AVEC GEMINI
 # ============================================================================
 
-def build_gemini_prompt(raw_structure: List[Dict[str, Any]]) -> str:
-    """Construit le prompt pour l'API Gemini"""
-    text_representation = []
-    for item in raw_structure:
-        if item['type'] == 'image':
-            text_representation.append(f"[IMAGE: {item['ref_id']}]")
-        else:
-            content = item['content']
-            if len(content) > 150:
-                content = content[:150] + "..."
-            text_representation.append(f"[{item['type'].upper()}] {content}")
+# Documents longs : requêtes simultanées et tentatives par section
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_RETRIES = 3
+RETRY_BACKOFF = 1.0  # secondes, doublé à chaque nouvelle tentative
+
+# Types que le modèle peut attribuer à une ligne
+SEMANTIC_TYPES = ('h1', 'h2', 'h3', 'h4', 'p', 'image')
+
+# Estimation des jetons (≈ 4 caractères par jeton) : une paire [index, "type"]
+# coûte quelques jetons, plus l'enveloppe de la réponse
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKENS_PER_ELEMENT = 8
+OUTPUT_TOKENS_OVERHEAD = 16
+# Part de max_output_tokens visée par section (marge d'erreur de l'estimation)
+OUTPUT_BUDGET_RATIO = 0.75
+# Modèles qui « réfléchissent » avant de répondre : ces jetons sont décomptés de
+# max_output_tokens. Sans thinking_budget explicite, on leur en réserve cette part.
+THINKING_MODELS = ('gemini-2.5',)
+THINKING_RESERVE_RATIO = 0.5
+# finish_reason de Gemini : bloqué par les filtres, tronqué (MAX_TOKENS)
+FINISH_REASON_MAX_TOKENS = 3
+FINISH_REASON_SAFETY = 2
+# Éléments de la section précédente envoyés comme contexte (non classés)
+DEFAULT_CHUNK_OVERLAP = 3
+
+
+def _prompt_line(item: Dict[str, Any], index: Optional[int] = None) -> str:
+    # Élément de contexte (item['context']) : montré sans index, jamais classé
+    prefix = "-" if index is None or item.get('context') else str(index)
+    if item['type'] == 'image':
+        return f"{prefix} [IMAGE]"
+    content = item['content']
+    if len(content) > 150:
+        content = content[:150] + "..."
+    return f"{prefix} [{item['type'].upper()}] {content}"
+
+
+def build_gemini_prompt(
+    raw_structure: List[Dict[str, Any]],
+    context: Optional[List[Dict[str, Any]]] = None
+) -> str:
+    """
+    Construit le prompt pour l'API Gemini
     
-    structure_text = "\n".join(text_representation)
+    Chaque ligne porte un index ; le modèle ne renvoie que des paires
+    [index, type] et le texte est réinjecté localement (merge_classification) :
+    la sortie ne grandit plus avec la longueur du texte et le contenu reste
+    celui de l'auteur, même au-delà des 150 caractères envoyés.
+    
+    context : éléments qui précèdent la section, montrés sans index pour que
+    les niveaux de titres restent cohérents d'une section à l'autre (le premier
+    titre n'est alors plus forcément un h1). Des éléments de contexte peuvent
+    aussi figurer dans raw_structure (item['context']) : ils gardent leur
+    place, sans index.
+    """
+    structure_text = "\n".join(_prompt_line(item, index) for index, item in enumerate(raw_structure))
+    
+    context_text = ""
+    heading_rule = "Premier titre = h1"
+    if context:
+        context_lines = "\n".join(_prompt_line(item) for item in context)
+        context_text = f"""
+CONTEXTE (éléments qui précèdent, à ne pas classer):
+{context_lines}
+"""
+        heading_rule = "Niveaux de titres cohérents avec le CONTEXTE"
+    if any(item.get('context') for item in raw_structure):
+        context_text += """
+Les lignes « - » du DOCUMENT sont du contexte déjà classé : ne pas les classer.
+"""
+        heading_rule = "Niveaux de titres cohérents avec le CONTEXTE"
     
     prompt = f"""Analyse ce document et retourne UNIQUEMENT un tableau JSON.
 
 RÈGLES STRICTES:
-1. Types: h1, h2, h3, h4, p, image
-2. Premier titre = h1
-3. Images: utilise les IDs fournis
-4. Format: SEULEMENT le JSON, rien d'autre
-
+1. Chaque ligne commence par son index
+2. Types: h1, h2, h3, h4, p, image
+3. {heading_rule}
+4. Une paire [index, type] par ligne, sans le texte
+5. Format: SEULEMENT le JSON, rien d'autre
+{context_text}
 DOCUMENT:
 {structure_text}
 
 RETOURNE UNIQUEMENT CE FORMAT (exemple):
-[{{"type":"h1","content":"Titre"}},{{"type":"p","content":"Texte"}},{{"type":"image","ref_id":"__IMAGE_1__"}}]"""
+[[0,"h1"],[1,"p"],[2,"image"]]"""
 
     return prompt
 
 
+def default_semantic_type(item: Dict[str, Any]) -> str:
+    """
+    Type d'une ligne que le modèle n'a pas classée : proposition du détecteur
+    local si elle en porte une (mode hybride), sinon type déduit des styles Word
+    """
+    if item['type'] == 'image':
+        return 'image'
+    if item.get('proposed_type'):
+        return item['proposed_type']
+    if item['type'].startswith('style_h'):
+        return item['type'][len('style_'):]
+    return 'p'
+
+
+def parse_index_response(response_text: str, count: int) -> Dict[int, str]:
+    """
+    Lit la réponse [[index, type], ...] : {index: type}
+    Les paires invalides (index hors limites, type inconnu) et les doublons
+    sont ignorés ; lève une exception si aucune paire n'est exploitable.
+    """
+    pairs = json.loads(response_text)
+    if not isinstance(pairs, list):
+        raise Exception("La réponse doit être une liste de paires [index, type]")
+    
+    types = {}
+    for pair in pairs:
+        if not isinstance(pair, (list, tuple)) or len(pair) < 2:
+            continue
+        index, elem_type = pair[0], pair[1]
+        if not isinstance(index, int) or not 0 <= index < count:
+            continue
+        if elem_type not in SEMANTIC_TYPES or index in types:
+            continue
+        types[index] = elem_type
+    
+    if count and not types:
+        raise Exception("Aucune paire [index, type] valide dans la réponse")
+    return types
+
+
+def merge_classification(raw_structure: List[Dict[str, Any]], types: Dict[int, str]) -> List[Dict[str, Any]]:
+    """
+    Structure sémantique : types du modèle + contenu d'origine, dans l'ordre du document
+    Une image reste une image ; une ligne non classée garde son type par défaut
+    (default_semantic_type).
+    """
+    missing = 0
+    semantic_structure = []
+    for index, item in enumerate(raw_structure):
+        if item['type'] == 'image':
+            semantic_structure.append({'type': 'image', 'ref_id': item['ref_id']})
+            continue
+        
+        elem_type = types.get(index)
+        if elem_type is None and not item.get('context'):
+            missing += 1
+        if elem_type is None or elem_type == 'image':
+            elem_type = default_semantic_type(item)
+        semantic_structure.append({'type': elem_type, 'content': item['content']})
+    
+    if missing:
+        print(f"⚠️  {missing} éléments non classés par le modèle (type par défaut conservé)", file=sys.stderr)
+    return semantic_structure
+
+
+def thinking_token_reserve(model: genai.GenerativeModel, max_output_tokens: int) -> int:
+    """Jetons de réflexion à soustraire de max_output_tokens (0 pour un modèle sans réflexion)"""
+    config = getattr(model, '_generation_config', None) or GENERATION_CONFIG
+    thinking_config = config.get('thinking_config') or {}
+    if thinking_config.get('thinking_budget') is not None:
+        return max(0, min(int(thinking_config['thinking_budget']), max_output_tokens))
+    model_name = getattr(model, 'model_name', '') or ''
+    if any(tag in model_name for tag in THINKING_MODELS):
+        return int(max_output_tokens * THINKING_RESERVE_RATIO)
+    return 0
+
+
+def output_token_budget(model: genai.GenerativeModel) -> int:
+    """
+    Jetons de sortie visés par requête : une part de ce qu'il reste de
+    max_output_tokens une fois la réflexion du modèle déduite
+    """
+    config = getattr(model, '_generation_config', None) or GENERATION_CONFIG
+    max_output_tokens = config.get('max_output_tokens') or GENERATION_CONFIG['max_output_tokens']
+    available = max_output_tokens - thinking_token_reserve(model, max_output_tokens)
+    return max(OUTPUT_TOKENS_OVERHEAD + OUTPUT_TOKENS_PER_ELEMENT, int(available * OUTPUT_BUDGET_RATIO))
+
+
+def finish_reason(response: Any) -> Optional[int]:
+    """Raison de fin du premier candidat (None si inconnue)"""
+    candidates = getattr(response, 'candidates', None)
+    if not candidates:
+        return None
+    return candidates[0].finish_reason
+
+
+def estimate_output_tokens(item: Dict[str, Any], index: int) -> int:
+    """Jetons de la paire [index, "type"] qu'un élément coûte dans la réponse"""
+    if item.get('context'):
+        return 0
+    pair = json.dumps([index, 'image' if item['type'] == 'image' else 'h1'])
+    return max(OUTPUT_TOKENS_PER_ELEMENT, -(-len(pair) // CHARS_PER_TOKEN) + 2)
+
+
+def _raw_heading_level(item: Dict[str, Any]) -> Optional[int]:
+    if item['type'].startswith('style_h'):
+        return int(item['type'][len('style_h'):])
+    return None
+
+
+def plan_chunks(
+    raw_structure: List[Dict[str, Any]],
+    budget: int,
+    max_items: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """
+    Découpe le document en sections [début, fin) dont la réponse estimée
+    tient dans `budget` jetons (et d'au plus `max_items` éléments)
+    
+    Quand une section doit être coupée, la coupure se fait de préférence juste
+    avant un titre (le plus haut niveau, puis le plus tardif) situé dans la
+    seconde moitié de la section, pour ne pas séparer un titre de son contenu.
+    Un document qui tient dans le budget donne une seule section.
+    """
+    ranges = []
+    start = 0
+    count = len(raw_structure)
+    
+    while start < count:
+        # Fin maximale : le budget est atteint (au moins un élément par section)
+        used = OUTPUT_TOKENS_OVERHEAD
+        end = start
+        while end < count:
+            if max_items is not None and end - start >= max(1, max_items):
+                break
+            cost = estimate_output_tokens(raw_structure[end], end - start)
+            if end > start and used + cost > budget:
+                break
+            used += cost
+            end += 1
+        
+        if end < count:
+            best = None
+            for boundary in range(start + max(1, (end - start) // 2), end + 1):
+                level = _raw_heading_level(raw_structure[boundary])
+                if level is not None and (best is None or level <= best[0]):
+                    best = (level, boundary)
+            if best is not None:
+                end = best[1]
+        
+        ranges.append((start, end))
+        start = end
+    
+    return ranges
+
+
+def response_cache_key(model: genai.GenerativeModel, prompt: str) -> str:
+    """Clé du cache LLM : nom du modèle, configuration de génération et prompt"""
+    # GenerativeModel conserve la configuration passée à configure_gemini sous forme de dict
+    return llm_cache.LLMCache.make_key(
+        getattr(model, 'model_name', ''),
+        getattr(model, '_generation_config', None),
+        prompt
+    )
+
+
 def get_semantic_structure(
     raw_structure: List[Dict[str, Any]], 
     model: genai.GenerativeModel,
-    max_retries: int = 3
+    max_retries: int = 3,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cache: Optional[llm_cache.LLMCache] = None
 ) -> List[Dict[str, Any]]:
-    """Analyse avec l'API Gemini"""
+    """
+    Analyse avec l'API Gemini
+    concurrency : requêtes simultanées si le document doit être traité en sections
+    cache : réponses déjà validées pour un prompt identique (aucun appel à l'API)
+    """
+    # Sections planifiées d'avance : pas d'appel complet voué à être tronqué
+    if len(plan_chunks(raw_structure, output_token_budget(model))) > 1:
+        print("📊 Document long, traitement par sections...", file=sys.stderr)
+        return process_long_document(raw_structure, model, concurrency, cache=cache)
+    
     prompt = build_gemini_prompt(raw_structure)
     
+    cache_key = None
+    if cache is not None:
+        cache_key = response_cache_key(model, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            try:
+                types = parse_index_response(cached, len(raw_structure))
+                print(f"♻️  Réponse servie par le cache: {len(types)} éléments classés", file=sys.stderr)
+                return merge_classification(raw_structure, types)
+            except Exception:
+                # Entrée invalide : on l'ignore et on interroge l'API
+                pass
+    
     for attempt in range(max_retries):
         try:
             if attempt > 0:
@@ -380,32 +569,32 @@ def get_semantic_structure(
             
             response = model.generate_content(prompt)
             
-            if hasattr(response, 'candidates') and response.candidates:
-                finish_reason = response.candidates[0].finish_reason
-                if finish_reason == 2:
-                    print("⚠️  Réponse bloquée par les filtres de sécurité, retry...", file=sys.stderr)
-                    continue
-                elif finish_reason == 3:
-                    print("⚠️  Réponse tronquée, retry...", file=sys.stderr)
-                    if len(raw_structure) > 20:
-                        print("📊 Document trop long, traitement par sections...", file=sys.stderr)
-                        return process_long_document(raw_structure, model)
-                    continue
+            reason = finish_reason(response)
+            if reason == FINISH_REASON_SAFETY:
+                print("⚠️  Réponse bloquée par les filtres de sécurité, retry...", file=sys.stderr)
+                continue
+            elif reason == FINISH_REASON_MAX_TOKENS:
+                if len(raw_structure) > 1:
+                    # Estimation trop optimiste : renvoyer le même prompt serait tronqué
+                    # de la même façon, on force au moins deux sections
+                    print("⚠️  Réponse tronquée, traitement par sections...", file=sys.stderr)
+                    return process_long_document(
+                        raw_structure, model, concurrency, cache=cache,
+                        max_items=math.ceil(len(raw_structure) / 2)
+                    )
+                print("⚠️  Réponse tronquée, retry...", file=sys.stderr)
+                continue
             
             if not response or not response.text:
                 print("⚠️  Pas de réponse texte, retry...", file=sys.stderr)
                 continue
             
-            response_text = response.text.strip()
-            response_text = re.sub(r'^```json\s*', '', response_text)
-            response_text = re.sub(r'^```\s*', '', response_text)
-            response_text = re.sub(r'\s*```$', '', response_text)
-            response_text = response_text.strip()
+            response_text = _strip_code_fences(response.text)
             
             print("✅ Réponse reçue de Gemini", file=sys.stderr)
             
             try:
-                semantic_structure = json.loads(response_text)
+                types = parse_index_response(response_text, len(raw_structure))
             except json.JSONDecodeError as e:
                 print(f"❌ Erreur de parsing JSON: {e}", file=sys.stderr)
                 if attempt < max_retries - 1:
@@ -415,18 +604,11 @@ def get_semantic_structure(
                     print(f"Réponse brute de l'IA:\n{response_text[:500]}...", file=sys.stderr)
                     raise Exception(f"JSON invalide après {max_retries} tentatives: {e}")
             
-            if not isinstance(semantic_structure, list):
-                raise Exception("La structure sémantique doit être une liste")
-            
-            for item in semantic_structure:
-                if not isinstance(item, dict):
-                    raise Exception("Chaque élément doit être un dictionnaire")
-                if 'type' not in item:
-                    raise Exception("Chaque élément doit avoir un 'type'")
-                if item['type'] != 'image' and 'content' not in item:
-                    raise Exception(f"Les éléments de type '{item['type']}' doivent avoir un 'content'")
+            semantic_structure = merge_classification(raw_structure, types)
             
             print(f"✅ Structure sémantique validée: {len(semantic_structure)} éléments", file=sys.stderr)
+            if cache is not None:
+                cache.put(cache_key, response_text)
             return semantic_structure
             
         except Exception as e:
@@ -440,56 +622,371 @@ def get_semantic_structure(
     raise Exception("Impossible d'obtenir une réponse valide de l'API Gemini")
 
 
+def _strip_code_fences(text: str) -> str:
+    """Retire les balises ```json ... ``` éventuelles autour de la réponse"""
+    text = text.strip()
+    text = re.sub(r'^```json\s*', '', text)
+    text = re.sub(r'^```\s*', '', text)
+    text = re.sub(r'\s*```$', '', text)
+    return text.strip()
+
+
+def process_chunk(
+    chunk: List[Dict[str, Any]],
+    model: genai.GenerativeModel,
+    label: str,
+    max_retries: int = DEFAULT_CHUNK_RETRIES,
+    cache: Optional[llm_cache.LLMCache] = None,
+    context: Optional[List[Dict[str, Any]]] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP
+) -> List[Dict[str, Any]]:
+    """
+    Analyse une section ; seule cette section est renvoyée en cas d'échec
+    (attente exponentielle entre les tentatives)
+    Une réponse tronquée n'est pas renvoyée telle quelle : la section est
+    coupée en deux moitiés, chacune avec son contexte.
+    Si toutes les tentatives échouent, la section garde ses types par défaut
+    (default_semantic_type : styles Word, ou proposition locale en mode hybride).
+    context : éléments précédents montrés au modèle sans être classés
+    """
+    if all(item.get('context') for item in chunk):
+        # Moitié de section tronquée sans rien à classer
+        return merge_classification(chunk, {})
+    
+    prompt = build_gemini_prompt(chunk, context)
+    
+    cache_key = None
+    if cache is not None:
+        cache_key = response_cache_key(model, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            try:
+                return merge_classification(chunk, parse_index_response(cached, len(chunk)))
+            except Exception:
+                pass
+    
+    for attempt in range(max_retries):
+        if attempt > 0:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            print(f"🔄 Section {label} : tentative {attempt + 1}/{max_retries}...", file=sys.stderr)
+        try:
+            response = model.generate_content(prompt)
+            if finish_reason(response) == FINISH_REASON_MAX_TOKENS and len(chunk) > 1:
+                print(f"⚠️  Section {label} tronquée, coupée en deux", file=sys.stderr)
+                middle = len(chunk) // 2
+                first, second = chunk[:middle], chunk[middle:]
+                second_context = ((context or []) + first)[-overlap:] if overlap > 0 else None
+                return (
+                    process_chunk(first, model, f"{label}a", max_retries, cache, context, overlap)
+                    + process_chunk(second, model, f"{label}b", max_retries, cache, second_context, overlap)
+                )
+            if not response or not response.text:
+                raise ValueError("pas de réponse texte")
+            
+            response_text = _strip_code_fences(response.text)
+            # Index locaux à la section : deux sections identiques partagent leur entrée de cache
+            types = parse_index_response(response_text, len(chunk))
+            if cache is not None:
+                cache.put(cache_key, response_text)
+            return merge_classification(chunk, types)
+        except Exception as e:
+            print(f"⚠️  Erreur section {label}: {e}", file=sys.stderr)
+    
+    print(f"❌ Section {label} non classée après {max_retries} tentatives (types par défaut conservés)", file=sys.stderr)
+    return merge_classification(chunk, {})
+
+
 def process_long_document(
     raw_structure: List[Dict[str, Any]], 
-    model: genai.GenerativeModel
+    model: genai.GenerativeModel,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_CHUNK_RETRIES,
+    cache: Optional[llm_cache.LLMCache] = None,
+    budget: Optional[int] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+    max_items: Optional[int] = None
 ) -> List[Dict[str, Any]]:
-    """Traite un document long en sections"""
+    """
+    Traite un document long en sections
+    
+    Les sections sont planifiées par plan_chunks (budget de jetons de sortie,
+    coupure aux titres) et chacune reçoit en contexte les `overlap` derniers
+    éléments de la précédente, ainsi que le dernier titre rencontré. Elles
+    sont envoyées simultanément (au plus `concurrency` requêtes en cours) :
+    la durée dépend de la limite de concurrence et non plus du nombre de
+    sections. Les résultats sont
+    réassemblés dans l'ordre du document.
+    """
     print("🔄 Traitement du document en sections...", file=sys.stderr)
     
-    chunk_size = 15
-    chunks = [raw_structure[i:i + chunk_size] for i in range(0, len(raw_structure), chunk_size)]
+    ranges = plan_chunks(raw_structure, budget or output_token_budget(model), max_items)
+    all_results = classify_ranges(raw_structure, ranges, model, concurrency, max_retries, cache, overlap)
+    
+    print(f"✅ Document complet traité: {len(all_results)} éléments", file=sys.stderr)
+    return all_results
+
+
+def _is_heading(item: Dict[str, Any]) -> bool:
+    return item['type'].startswith('style_h') or item['type'] in SEMANTIC_TYPES[:4]
+
+
+def context_positions(
+    context_structure: List[Dict[str, Any]],
+    start: int,
+    overlap: int = DEFAULT_CHUNK_OVERLAP
+) -> List[int]:
+    """
+    Index du contexte d'une section commençant à `start` : les `overlap`
+    éléments qui la précèdent, précédés du dernier titre rencontré avant eux
+    s'ils n'en contiennent aucun (c'est lui qui fixe le niveau des titres)
+    """
+    window_start = max(0, start - overlap)
+    positions = list(range(window_start, start))
+    if any(_is_heading(context_structure[index]) for index in positions):
+        return positions
+    for index in range(window_start - 1, -1, -1):
+        if _is_heading(context_structure[index]):
+            return [index] + positions
+    return positions
+
+
+def range_context(
+    context_structure: List[Dict[str, Any]],
+    start: int,
+    overlap: int = DEFAULT_CHUNK_OVERLAP
+) -> List[Dict[str, Any]]:
+    """Contexte d'une section commençant à `start` (voir context_positions)"""
+    return [context_structure[index] for index in context_positions(context_structure, start, overlap)]
+
+
+def classify_ranges(
+    raw_structure: List[Dict[str, Any]],
+    ranges: List[Tuple[int, int]],
+    model: genai.GenerativeModel,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_CHUNK_RETRIES,
+    cache: Optional[llm_cache.LLMCache] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+    context_structure: Optional[List[Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Envoie les sections [début, fin) de raw_structure au modèle, simultanément
     
+    Chaque section reçoit son contexte (range_context), pris dans
+    context_structure (même longueur que raw_structure, par défaut
+    raw_structure elle-même). Les résultats sont concaténés dans l'ordre des sections.
+    """
+    if context_structure is None:
+        context_structure = raw_structure
+    chunks = [
+        (raw_structure[start:end], range_context(context_structure, start, overlap))
+        for start, end in ranges
+    ]
     all_results = []
+    for results in classify_chunks(chunks, model, concurrency, max_retries, cache, overlap):
+        all_results.extend(results)
+    return all_results
+
+
+def classify_chunks(
+    chunks: List[Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]],
+    model: genai.GenerativeModel,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_CHUNK_RETRIES,
+    cache: Optional[llm_cache.LLMCache] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP
+) -> List[List[Dict[str, Any]]]:
+    """
+    Envoie des sections (éléments, contexte) au modèle, au plus `concurrency`
+    requêtes simultanées ; un résultat par section, dans l'ordre des sections
+    """
+    print(f"📊 {len(chunks)} sections, {min(concurrency, len(chunks))} requêtes simultanées", file=sys.stderr)
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="gemini") as executor:
+        futures = [
+            executor.submit(
+                process_chunk,
+                chunk,
+                model,
+                f"{idx + 1}/{len(chunks)}",
+                max_retries,
+                cache,
+                context,
+                overlap
+            )
+            for idx, (chunk, context) in enumerate(chunks)
+        ]
+        # Ordre de soumission = ordre du document
+        return [future.result() for future in futures]
+
+
+# ============================================================================
+# CLASSIFICATION HYBRIDE (DÉTECTEUR LOCAL + GEMINI)
+# ============================================================================
+
+# Certitude minimale d'une décision locale pour ne pas consulter le modèle
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+
+def local_certainty(elem_type: str, confidence: float) -> float:
+    """
+    Certitude d'une décision du HeadingDetector
+    Sa confiance est un score de « titre » : élevée pour un titre sûr, basse
+    pour un paragraphe sûr.
+    """
+    certainty = confidence if elem_type != 'p' else 1.0 - confidence
+    return max(0.0, min(certainty, 1.0))
+
+
+def classify_locally(
+    raw_structure: List[Dict[str, Any]],
+    threshold: float = DEFAULT_CONFIDENCE_THRESHOLD
+) -> Tuple[Dict[int, str], List[int]]:
+    """
+    Classe ce qui peut l'être sans le modèle
+    - images et styles de titres Word : définitifs
+    - autres paragraphes : HeadingDetector, retenu si sa certitude atteint `threshold`
     
-    for idx, chunk in enumerate(chunks):
-        print(f"📊 Traitement section {idx + 1}/{len(chunks)}...", file=sys.stderr)
-        prompt = build_gemini_prompt(chunk)
+    Returns:
+        tuple: ({index: type} pour chaque élément, index des éléments incertains)
+        (les éléments incertains portent la proposition du détecteur)
+    """
+    types = {}
+    uncertain = []
+    prev_text = None
+    
+    for index, item in enumerate(raw_structure):
+        if item['type'] == 'image' or item['type'].startswith('style_h'):
+            types[index] = default_semantic_type(item)
+            continue
         
+        elem_type, confidence = HeadingDetector.detect_heading_level(item['content'], prev_text)
+        prev_text = item['content']
+        # Le modèle ne connaît que h1-h4
+        if elem_type in ('h5', 'h6'):
+            elem_type = 'h4'
+        types[index] = elem_type
+        if local_certainty(elem_type, confidence) < threshold:
+            uncertain.append(index)
+    
+    return types, uncertain
+
+
+def plan_hybrid_requests(
+    local_structure: List[Dict[str, Any]],
+    uncertain: List[int],
+    budget: int,
+    overlap: int = DEFAULT_CHUNK_OVERLAP
+) -> List[List[Tuple[int, bool]]]:
+    """
+    Regroupe les éléments incertains en requêtes au modèle
+    
+    Deux éléments incertains séparés par au plus 2 × `overlap` éléments sûrs
+    forment un même passage ; chaque passage est précédé de son contexte
+    (context_positions). Les éléments sûrs (passage et contexte) sont montrés
+    sans index : ils ne coûtent rien dans la réponse et gardent leur type
+    local. Les passages sont ensuite regroupés dans des requêtes dont la
+    réponse estimée tient dans `budget`, comme le fait plan_chunks : quelques
+    requêtes pour tout le document plutôt qu'une par passage isolé.
+    
+    Returns:
+        list: Une liste de (index, contexte ?) par requête, dans l'ordre du document
+    """
+    uncertain_set = set(uncertain)
+    spans = []
+    for index in uncertain:
+        if spans and index - spans[-1][1] <= 2 * overlap:
+            spans[-1][1] = index + 1
+        else:
+            spans.append([index, index + 1])
+    
+    # Passages (contexte + éléments), recoupés si un seul dépasse le budget
+    marked = [{**item, 'context': index not in uncertain_set} for index, item in enumerate(local_structure)]
+    segments = []
+    for start, end in spans:
+        for chunk_start, chunk_end in plan_chunks(marked[start:end], budget):
+            first, last = start + chunk_start, start + chunk_end
+            segments.append(
+                [(index, True) for index in context_positions(local_structure, first, overlap)]
+                + [(index, index not in uncertain_set) for index in range(first, last)]
+            )
+    
+    requests = []
+    used = 0
+    for segment in segments:
+        cost = sum(
+            estimate_output_tokens(marked[index], index) for index, is_context in segment if not is_context
+        )
+        if requests and used + cost + OUTPUT_TOKENS_OVERHEAD <= budget:
+            requests[-1].extend(segment)
+            used += cost
+        else:
+            requests.append(list(segment))
+            used = cost + OUTPUT_TOKENS_OVERHEAD
+    return requests
+
+
+def get_hybrid_structure(
+    raw_structure: List[Dict[str, Any]],
+    get_model: Callable[[], genai.GenerativeModel],
+    threshold: float = DEFAULT_CONFIDENCE_THRESHOLD,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cache: Optional[llm_cache.LLMCache] = None
+) -> List[Dict[str, Any]]:
+    """
+    Structure sémantique hybride : décisions locales sûres, modèle pour le reste
+    
+    Seuls les passages contenant des éléments incertains sont envoyés au
+    modèle, chacun précédé de ses voisins déjà classés localement (contexte) :
+    un titre incertain est situé par rapport aux titres qui l'entourent au
+    lieu d'être jugé isolément. Les passages sont regroupés en requêtes selon
+    le budget de jetons (plan_hybrid_requests). get_model n'est appelé que
+    s'il y a des éléments incertains. Si le modèle échoue, la proposition du
+    détecteur local est conservée.
+    """
+    types, uncertain = classify_locally(raw_structure, threshold)
+    print(
+        f"🧭 Mode hybride: {len(raw_structure) - len(uncertain)}/{len(raw_structure)} éléments "
+        f"classés localement, {len(uncertain)} envoyés au modèle",
+        file=sys.stderr
+    )
+    
+    if uncertain:
         try:
-            response = model.generate_content(prompt)
-            if response and response.text:
-                response_text = response.text.strip()
-                response_text = re.sub(r'^```json\s*', '', response_text)
-                response_text = re.sub(r'^```\s*', '', response_text)
-                response_text = re.sub(r'\s*```$', '', response_text)
-                response_text = response_text.strip()
-                
-                chunk_result = json.loads(response_text)
-                all_results.extend(chunk_result)
+            model = get_model()
+            # Contexte montré avec les types locaux (h2, p...) plutôt que les styles Word
+            local_structure = merge_classification(raw_structure, types)
+            requests = plan_hybrid_requests(local_structure, uncertain, output_token_budget(model))
+            # Une section en échec (ou un index absent de la réponse) retombe sur
+            # la proposition du détecteur, pas sur le style Word
+            chunks = [
+                ([
+                    {**local_structure[index], 'context': True} if is_context
+                    else {**raw_structure[index], 'proposed_type': types[index]}
+                    for index, is_context in request
+                ], None)
+                for request in requests
+            ]
+            results = classify_chunks(chunks, model, concurrency, cache=cache)
+            # merge_classification conserve l'ordre et la longueur de chaque requête
+            for request, semantic_chunk in zip(requests, results):
+                for (index, is_context), item in zip(request, semantic_chunk):
+                    if not is_context:
+                        types[index] = item['type']
         except Exception as e:
-            print(f"⚠️  Erreur section {idx + 1}: {e}", file=sys.stderr)
-            continue
+            print(f"⚠️  Modèle indisponible ({e}), décisions locales conservées", file=sys.stderr)
     
-    print(f"✅ Document complet traité: {len(all_results)} éléments", file=sys.stderr)
-    return all_results
+    return merge_classification(raw_structure, types)
 
 
 # ============================================================================
 # GÉNÉRATION DES WIDGETS ELEMENTOR
 # ============================================================================
 
-def generate_unique_id() -> str:
-    """Génère un ID unique pour les éléments Elementor"""
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=7))
-
-
-def create_heading_widget(content: str, tag: str) -> Dict[str, Any]:
+def create_heading_widget(content: str, tag: str, widget_id: str) -> Dict[str, Any]:
     """Crée un widget heading Elementor"""
     return {
-        "id": generate_unique_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "title": content,
@@ -500,10 +997,10 @@ def create_heading_widget(content: str, tag: str) -> Dict[str, Any]:
     }
 
 
-def create_text_editor_widget(content: str) -> Dict[str, Any]:
+def create_text_editor_widget(content: str, widget_id: str) -> Dict[str, Any]:
     """Crée un widget text-editor Elementor"""
     return {
-        "id": generate_unique_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "editor": content
@@ -513,12 +1010,12 @@ def create_text_editor_widget(content: str) -> Dict[str, Any]:
     }
 
 
-def create_image_widget(ref_id: str, image_info: Optional[Dict] = None) -> Dict[str, Any]:
+def create_image_widget(ref_id: str, widget_id: str, image_info: Optional[Dict] = None) -> Dict[str, Any]:
     """Crée un widget image Elementor"""
     image_url = "https://example.com/placeholder.jpg"
     
     widget = {
-        "id": generate_unique_id(),
+        "id": widget_id,
         "elType": "widget",
         "settings": {
             "image": {
@@ -546,9 +1043,16 @@ def build_elementor_json(
     semantic_structure: List[Dict[str, Any]], 
     image_data: Dict[str, Any],
     layout_type: str = "single_column",
-    distribution_strategy: str = "auto"
+    distribution_strategy: str = "auto",
+    ids: Optional[ElementIds] = None
 ) -> Dict[str, Any]:
-    """Construit le JSON Elementor final"""
+    """Construit le JSON Elementor final (IDs déterministes, dérivés du contenu par défaut)"""
+    if ids is None:
+        ids = ElementIds(structure_seed(semantic_structure, image_data))
+    
+    # Chemin de chaque élément = sa position dans la structure, indépendante du layout
+    item_paths = {id(item): f"widget/{idx}" for idx, item in enumerate(semantic_structure)}
+    
     try:
         from layouts import LayoutConfig, ContentDistributor
         layout_config = LayoutConfig.get_layout(layout_type)
@@ -584,7 +1088,7 @@ def build_elementor_json(
     
     for col_idx, (col_config, col_elements) in enumerate(zip(columns_config, distributed_elements)):
         column = {
-            "id": generate_unique_id(),
+            "id": ids.make(f"section/column/{col_idx}"),
             "elType": "column",
             "settings": {
                 "_column_size": col_config["size"],
@@ -595,19 +1099,20 @@ def build_elementor_json(
         
         for item in col_elements:
             item_type = item.get('type')
+            widget_id = ids.make(item_paths.get(id(item), f"column/{col_idx}/widget/{len(column['elements'])}"))
             
             if item_type in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                widget = create_heading_widget(item['content'], item_type)
+                widget = create_heading_widget(item['content'], item_type, widget_id)
                 column["elements"].append(widget)
                 
             elif item_type == 'p':
-                widget = create_text_editor_widget(item['content'])
+                widget = create_text_editor_widget(item['content'], widget_id)
                 column["elements"].append(widget)
                 
             elif item_type == 'image':
                 ref_id = item.get('ref_id')
                 img_info = image_data.get(ref_id) if ref_id else None
-                widget = create_image_widget(ref_id, img_info)
+                widget = create_image_widget(ref_id, widget_id, img_info)
                 column["elements"].append(widget)
             
             else:
@@ -617,7 +1122,7 @@ def build_elementor_json(
     
     elementor_content = [
         {
-            "id": generate_unique_id(),
+            "id": ids.make("section"),
             "elType": "section",
             "settings": layout_config.get("spacing", {}),
             "elements": elementor_columns
@@ -684,14 +1189,61 @@ def main():
         help='Stratégie de distribution du contenu'
     )
     
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='JSON compact (sans indentation)'
+    )
+    
+    parser.add_argument(
+        '--hybrid',
+        action='store_true',
+        help='Classification hybride : styles Word et décisions locales sûres sont définitifs, '
+             'seuls les éléments incertains sont envoyés à Gemini'
+    )
+    
+    parser.add_argument(
+        '--confidence',
+        type=float,
+        default=DEFAULT_CONFIDENCE_THRESHOLD,
+        help='Certitude minimale (0-1) d\'une décision locale en mode hybride'
+    )
+    
+    parser.add_argument(
+        '--llm-cache',
+        type=str,
+        default=llm_cache.DEFAULT_PATH,
+        help='Base SQLite du cache des réponses Gemini'
+    )
+    
+    parser.add_argument(
+        '--no-llm-cache',
+        action='store_true',
+        help='Désactive le cache des réponses Gemini'
+    )
+    
+    parser.add_argument(
+        '--llm-cache-readonly',
+        action='store_true',
+        help='Consulte le cache sans jamais l\'écrire (CI) ; aussi via LLM_CACHE_READONLY=1'
+    )
+    
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Nombre maximal de requêtes Gemini simultanées (documents longs traités en sections)'
+    )
+    
     args = parser.parse_args()
     
     try:
         if args.verbose:
             print("🔧 Initialisation...", file=sys.stderr)
         
-        api_key = load_api_key()
-        model = configure_gemini(api_key)
+        # En mode hybride, Gemini n'est configuré que si des éléments restent incertains
+        if not args.hybrid:
+            model = configure_gemini(load_api_key())
         
         if args.verbose:
             print(f"📄 Parsing du document '{args.docx_file}'...", file=sys.stderr)
@@ -705,7 +1257,26 @@ def main():
         if args.verbose:
             print("🤖 Analyse sémantique avec Gemini...", file=sys.stderr)
         
-        semantic_structure = get_semantic_structure(raw_structure, model)
+        cache = None
+        if not args.no_llm_cache:
+            read_only = args.llm_cache_readonly or os.getenv('LLM_CACHE_READONLY', '') in ('1', 'true', 'yes')
+            cache = llm_cache.LLMCache(args.llm_cache, read_only=read_only)
+        
+        if args.hybrid:
+            semantic_structure = get_hybrid_structure(
+                raw_structure,
+                lambda: configure_gemini(load_api_key()),
+                threshold=args.confidence,
+                concurrency=args.concurrency,
+                cache=cache
+            )
+        else:
+            semantic_structure = get_semantic_structure(
+                raw_structure, model, concurrency=args.concurrency, cache=cache
+            )
+        
+        if args.verbose and cache is not None:
+            print(f"   Cache LLM: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
         
         if args.verbose:
             print("🗏 Construction du JSON Elementor...", file=sys.stderr)
@@ -722,15 +1293,12 @@ def main():
         if args.verbose:
             print("✨ Finalisation...", file=sys.stderr)
         
-        json_output = json.dumps(elementor_json, ensure_ascii=False, indent=2)
-        
         if args.output:
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(json_output)
+            save_json(elementor_json, args.output, compact=args.compact)
             if args.verbose:
                 print(f"✅ JSON sauvegardé dans '{args.output}'", file=sys.stderr)
         else:
-            print(json_output)
+            print_json(elementor_json, compact=args.compact)
         
         if args.verbose:
             print("✅ Conversion terminée avec succès!", file=sys.stderr)
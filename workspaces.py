@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+workspaces.py - Espaces de travail isolés par conversion
+
+Chaque conversion de l'application écrit dans son propre dossier
+(outputs/jobs/<id>/ : JSON + images) au lieu du dossier partagé outputs/.
+Un balayeur en arrière-plan supprime les espaces expirés (TTL depuis le
+dernier accès) puis les plus anciens tant que le quota disque est dépassé.
+Avec un stockage d'images partagé, les références des espaces supprimés
+sont libérées et les images qui ne servent plus sont effacées.
+
+Usage:
+    python workspaces.py sweep --ttl-hours 6 --max-mb 2048
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from media_store import MediaStore
+
+
+DEFAULT_ROOT = os.path.join("outputs", "jobs")
+DEFAULT_TTL = 6 * 3600  # 6 heures
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 Go
+DEFAULT_SWEEP_INTERVAL = 300
+
+# Un espace utilisé il y a moins de MIN_AGE secondes n'est jamais évincé pour
+# le quota : la conversion qui l'écrit est peut-être en cours
+MIN_AGE = 300
+
+IMAGES_DIRNAME = "images"
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """Création, accès et éviction des espaces de travail"""
+
+    def __init__(
+        self,
+        root: str = DEFAULT_ROOT,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        media_store: Optional[MediaStore] = None
+    ):
+        """
+        Args:
+            media_store: Stockage où les conversions ont écrit leurs images
+                (identifiant de conversion = ID de l'espace)
+        """
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.media_store = media_store
+        self._sweeper: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def images_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id, IMAGES_DIRNAME)
+
+    def create(self) -> str:
+        """Crée un espace vide et retourne son ID"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.images_dir(job_id))
+        return job_id
+
+    def exists(self, job_id: str) -> bool:
+        return os.path.isdir(self.path(job_id))
+
+    def touch(self, job_id: str):
+        """Marque l'espace comme utilisé (repousse son expiration)"""
+        try:
+            os.utime(self.path(job_id))
+        except OSError:
+            pass
+
+    def remove(self, job_id: str):
+        shutil.rmtree(self.path(job_id), ignore_errors=True)
+        if self.media_store is not None:
+            self.media_store.release(job_id)
+
+    def _list(self) -> List[Tuple[float, str]]:
+        jobs = []
+        for job_id in os.listdir(self.root):
+            try:
+                jobs.append((os.path.getmtime(self.path(job_id)), job_id))
+            except OSError:
+                continue
+        return sorted(jobs)
+
+    def sweep(self) -> Tuple[int, int]:
+        """
+        Supprime les espaces expirés, puis les plus anciens au-delà du quota
+
+        Returns:
+            tuple: (nombre d'espaces supprimés, octets libérés)
+        """
+        with self._lock:
+            now = time.time()
+            removed, freed = 0, 0
+            remaining = []
+
+            for last_access, job_id in self._list():
+                size = _dir_size(self.path(job_id))
+                if now - last_access > self.ttl:
+                    self.remove(job_id)
+                    removed += 1
+                    freed += size
+                else:
+                    remaining.append((last_access, job_id, size))
+
+            total = sum(size for _, _, size in remaining)
+            for last_access, job_id, size in remaining:
+                if total <= self.max_bytes:
+                    break
+                if now - last_access < MIN_AGE:
+                    continue
+                self.remove(job_id)
+                removed += 1
+                freed += size
+                total -= size
+
+        # Images qui ne servaient qu'aux espaces supprimés
+        if removed and self.media_store is not None:
+            self.media_store.gc()
+
+        return removed, freed
+
+    def start_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL):
+        """Lance le balayage périodique dans un thread démon (une seule fois)"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"⚠️  Erreur balayage des espaces de travail: {e}", file=sys.stderr)
+                time.sleep(interval)
+
+        self._sweeper = threading.Thread(target=run, name="workspace-sweeper", daemon=True)
+        self._sweeper.start()
+
+
+def main():
+    """Balayage manuel (cron)"""
+    parser = argparse.ArgumentParser(description="Éviction des espaces de travail de l'application")
+    parser.add_argument('command', choices=['sweep'])
+    parser.add_argument('--root', default=DEFAULT_ROOT, help='Dossier des espaces de travail')
+    parser.add_argument('--ttl-hours', type=float, default=DEFAULT_TTL / 3600, help='Durée de vie depuis le dernier accès')
+    parser.add_argument('--max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Quota disque en Mo')
+    parser.add_argument('--media-store', default=None, help="Stockage d'images partagé dont libérer les références")
+    args = parser.parse_args()
+
+    media_store = MediaStore(args.media_store) if args.media_store else None
+    manager = WorkspaceManager(
+        args.root,
+        ttl=args.ttl_hours * 3600,
+        max_bytes=args.max_mb * 1024 * 1024,
+        media_store=media_store
+    )
+    removed, freed = manager.sweep()
+    print(f"{removed} espaces supprimés, {freed / 1024 / 1024:.1f} Mo libérés")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())